@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""This script computes fleet-wide statistics over stored solar history"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import argparse
+import configparser
+from datetime import date
+from time import time, localtime
+import numpy as np
+from rich import box
+from rich.console import Console
+from rich.table import Table
+from utils.mongo import connect
+
+console = Console()
+
+PROJECTION = {
+    "_id": 0,
+    "System": 1,
+    "EpochLastReport": 1,
+    "Collected": 1,
+    "Status": 1,
+    "Reporting": 1,
+    "WeatherId": 1,
+}
+
+# Reporting gap histogram edges in seconds
+GAP_BINS = np.array([0, 900, 1800, 3600, 7200, 21600, 86400, np.inf])
+GAP_LABELS = ["<15m", "15-30m", "30m-1h", "1-2h", "2-6h", "6-24h", ">24h"]
+
+DAY = 86400
+
+# UTC offsets only change on quarter hour boundaries
+OFFSET_STEP = 900
+
+
+def load_columns(collection, query, batch_size=10000):
+    """Stream documents into columnar arrays
+
+    Documents are pulled in large batches with only the needed fields and
+    converted to NumPy one batch at a time, so memory stays close to the
+    size of the final arrays.
+
+    Returns:
+        dict: Column name -> array, plus "systems" and "statuses" lookups
+    """
+    systems, statuses = {}, {}
+    chunks = {
+        name: []
+        for name in ("system", "epoch", "collected", "status", "reporting", "weather")
+    }
+    rows = []
+
+    def flush():
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        chunks["system"].append(np.array(columns[0], dtype=np.int32))
+        chunks["epoch"].append(np.array(columns[1], dtype=np.int64))
+        chunks["collected"].append(np.array(columns[2], dtype=np.float64))
+        chunks["status"].append(np.array(columns[3], dtype=np.int16))
+        chunks["reporting"].append(np.array(columns[4], dtype=bool))
+        chunks["weather"].append(np.array(columns[5], dtype=np.int16))
+        rows.clear()
+
+    cursor = collection.find(query, PROJECTION, batch_size=batch_size)
+    for doc in cursor:
+        rows.append(
+            (
+                systems.setdefault(doc.get("System"), len(systems)),
+                doc["EpochLastReport"],
+                doc.get("Collected") or 0,
+                statuses.setdefault(doc.get("Status"), len(statuses)),
+                bool(doc.get("Reporting")),
+                doc.get("WeatherId", -1),
+            )
+        )
+        if len(rows) >= batch_size:
+            flush()
+    flush()
+
+    columns = {
+        name: np.concatenate(parts) if parts else np.array([])
+        for name, parts in chunks.items()
+    }
+    columns["systems"] = list(systems)
+    columns["statuses"] = list(statuses)
+    return columns
+
+
+def availability(cols):
+    """Share of samples reporting, per system"""
+    count = np.bincount(cols["system"], minlength=len(cols["systems"]))
+    up = np.bincount(
+        cols["system"], weights=cols["reporting"], minlength=len(cols["systems"])
+    )
+    return up / np.maximum(count, 1)
+
+
+def reporting_gaps(cols):
+    """Histogram of seconds between distinct reports, across all systems"""
+    order = np.lexsort((cols["epoch"], cols["system"]))
+    system = cols["system"][order]
+    epoch = cols["epoch"][order]
+    same = system[1:] == system[:-1]
+    gaps = np.diff(epoch)[same]
+    gaps = gaps[gaps > 0]
+    return np.histogram(gaps, bins=GAP_BINS)[0]
+
+
+def local_days(epochs):
+    """Local day number of each epoch, following DST changes
+
+    The UTC offset is looked up once per OFFSET_STEP of time covered,
+    rather than once per sample.
+    """
+    steps, inverse = np.unique(epochs // OFFSET_STEP, return_inverse=True)
+    offsets = np.array(
+        [localtime(int(step) * OFFSET_STEP).tm_gmtoff for step in steps],
+        dtype=np.int64,
+    )
+    return (epochs + offsets[inverse]) // DAY
+
+
+def daily_production(cols):
+    """Energy per system per local day
+
+    energy_today is cumulative, so a day's production is its largest sample.
+
+    Returns:
+        tuple: (system index, day number, energy, inverse index per sample)
+    """
+    day = local_days(cols["epoch"])
+    keys = cols["system"].astype(np.int64) * (1 << 32) + day
+    unique, inverse = np.unique(keys, return_inverse=True)
+    energy = np.zeros(len(unique))
+    np.maximum.at(energy, inverse, cols["collected"])
+    return (unique >> 32, unique & 0xFFFFFFFF, energy, inverse)
+
+
+def weather_correlation(cols, daily):
+    """Pearson correlation of daily production with mean cloud cover
+
+    OpenWeather ids 800-804 map to 0-4 (clear to overcast); anything else,
+    rain, snow and so on, counts as 5. Samples without a WeatherId are
+    ignored.
+
+    Returns:
+        float: Correlation, or None with fewer than three days of data
+    """
+    _, _, energy, inverse = daily
+    known = cols["weather"] >= 0
+    if not known.any():
+        return None
+    cover = np.where(
+        (cols["weather"] >= 800) & (cols["weather"] <= 804), cols["weather"] - 800, 5
+    )
+    total = np.bincount(inverse[known], weights=cover[known], minlength=len(energy))
+    count = np.bincount(inverse[known], minlength=len(energy))
+    days = count > 0
+    if days.sum() < 3:
+        return None
+    return float(np.corrcoef(total[days] / count[days], energy[days])[0, 1])
+
+
+def print_table(title, columns, rows):
+    """Print rows as a Rich table"""
+    table = Table(title=title, box=box.SIMPLE, style="cyan")
+    for index, column in enumerate(columns):
+        table.add_column(
+            column, style="cyan3", justify="left" if index == 0 else "right"
+        )
+    for row in rows:
+        table.add_row(*row)
+    console.print(table)
+
+
+def report(cols, limit):
+    """Print every statistic"""
+    systems = cols["systems"]
+
+    avail = availability(cols)
+    worst = np.argsort(avail)[:limit]
+    print_table(
+        "Availability (lowest first)",
+        ["System", "Reporting"],
+        [(str(systems[i]), f"{avail[i]:.1%}") for i in worst],
+    )
+
+    status_counts = np.bincount(cols["status"], minlength=len(cols["statuses"]))
+    print_table(
+        "Status",
+        ["Status", "Samples"],
+        [
+            (str(status), str(count))
+            for status, count in zip(cols["statuses"], status_counts)
+        ],
+    )
+
+    gaps = reporting_gaps(cols)
+    print_table(
+        "Reporting Gaps",
+        ["Gap", "Count"],
+        [(label, str(count)) for label, count in zip(GAP_LABELS, gaps)],
+    )
+
+    daily = daily_production(cols)
+    system_idx, day, energy, _ = daily
+    fleet_days, fleet_idx = np.unique(day, return_inverse=True)
+    fleet_energy = np.bincount(fleet_idx, weights=energy)
+    fleet_systems = np.bincount(fleet_idx)
+    print_table(
+        "Daily Production",
+        ["Day", "Systems", "Energy (Wh)", "Mean per system"],
+        [
+            (
+                date.fromordinal(int(d) + date(1970, 1, 1).toordinal()).isoformat(),
+                str(n),
+                f"{e:,.0f}",
+                f"{e / n:,.0f}",
+            )
+            for d, n, e in zip(
+                fleet_days[-limit:], fleet_systems[-limit:], fleet_energy[-limit:]
+            )
+        ],
+    )
+
+    corr = weather_correlation(cols, daily)
+    print_table(
+        "Weather Correlation",
+        ["Type", "Data"],
+        [
+            ("System-days", str(len(system_idx))),
+            (
+                "Production vs cloud cover (r)",
+                "n/a" if corr is None else f"{corr:+.3f}",
+            ),
+        ],
+    )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=30, help="history to analyze")
+    parser.add_argument("--system", action="append", help="limit to these systems")
+    parser.add_argument("--batch", type=int, default=10000, help="cursor batch size")
+    parser.add_argument("--limit", type=int, default=10, help="rows per table")
+    args = parser.parse_args()
+
+    start_time = time()
+
+    config = configparser.ConfigParser()
+    config.read("config.ini")
+    collection = connect(config)[config["MONGO"]["mongo_db"]][
+        config["MONGO"]["mongo_collect"]
+    ]
+
+    query = {"EpochLastReport": {"$gte": int(time()) - args.days * DAY}}
+    if args.system:
+        query["System"] = {"$in": args.system}
+
+    cols = load_columns(collection, query, args.batch)
+    console.log(
+        f"--- Loaded [bold cyan]{len(cols['epoch'])}[/bold cyan] samples from "
+        f"[bold cyan]{len(cols['systems'])}[/bold cyan] systems in "
+        f"[bold cyan]{(time() - start_time):.3f} seconds[/bold cyan] ---"
+    )
+
+    if len(cols["epoch"]):
+        report(cols, args.limit)
+    else:
+        console.log("[i]--- No data... ---[/i]")
+
+    console.log(
+        f"--- Script ran in [bold cyan]{(time() - start_time):.3f} seconds[/bold cyan] ---"
+    )
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Local stand-ins for Enphase, OpenWeather and MongoDB used by benchmark.py"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import itertools
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+from bson import ObjectId
+
+SUMMARY_PATH = re.compile(r"^/api/v2/systems/([^/]+)/summary")
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    """Answer the Enphase summary and OpenWeather current weather endpoints"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve canned JSON shaped like the real APIs"""
+        now = int(time())
+        match = SUMMARY_PATH.match(self.path)
+        if match:
+            body = {
+                "system_id": match.group(1),
+                "last_report_at": now - 600,
+                "energy_today": 12345,
+                "status": "normal",
+            }
+        elif self.path.startswith("/data/2.5/weather"):
+            body = {
+                "weather": [{"id": 800}],
+                "sys": {"sunrise": now - 3600, "sunset": now + 3600},
+            }
+        else:
+            self.send_error(404)
+            return
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Stay quiet"""
+
+
+class BacklogServer(ThreadingHTTPServer):
+    """Threaded server whose listen backlog takes a whole fleet sweep
+
+    The default backlog of 5 drops SYNs once a sweep opens more
+    connections at once, and the retransmit after about a second would be
+    timed as if it were the collector's own latency.
+    """
+
+    request_queue_size = 1024
+
+
+class FakeApiServer:
+    """Both APIs on one local port, served from a background thread"""
+
+    def __init__(self):
+        self.server = BacklogServer(("127.0.0.1", 0), FakeApiHandler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        """Stop serving"""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+OPERATORS = {
+    "$lt": lambda value, arg: value is not None and value < arg,
+    "$lte": lambda value, arg: value is not None and value <= arg,
+    "$gt": lambda value, arg: value is not None and value > arg,
+    "$gte": lambda value, arg: value is not None and value >= arg,
+    "$in": lambda value, arg: value in arg,
+}
+
+
+def matches(doc, query):
+    """Evaluate the small subset of MongoDB filters the collector uses"""
+    for field, cond in query.items():
+        value = doc.get(field)
+        if not isinstance(cond, dict):
+            cond = {"$in": [cond]}
+        if not all(OPERATORS[op](value, arg) for op, arg in cond.items()):
+            return False
+    return True
+
+
+class FakeCursor:
+    """List-backed cursor with the chaining methods the collector calls"""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=1):
+        """Sort in place by one field"""
+        self.docs.sort(key=lambda doc: doc.get(key), reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        """Keep the first ``count`` documents"""
+        self.docs = self.docs[:count]
+        return self
+
+    def batch_size(self, _):
+        """Batching does not apply in memory"""
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class Result:  # pylint: disable=too-few-public-methods
+    """Stand-in for pymongo write results"""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class FakeCollection:
+    """In-memory stand-in for the pymongo Collection methods the repo uses
+
+    Inserts copy documents, assign ObjectIds and keep them in insertion
+    order; queries are linear scans, like a collection without indexes.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.counter = itertools.count()
+
+    def insert_one(self, doc):
+        """Insert one document"""
+        doc.setdefault("_id", ObjectId())
+        self.insert_many([doc])
+        return Result(inserted_id=doc["_id"])
+
+    def insert_many(self, docs, ordered=True):  # pylint: disable=unused-argument
+        """Insert documents, assigning _id like pymongo does"""
+        ids = []
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+            self.docs[doc["_id"]] = dict(doc)
+            ids.append(doc["_id"])
+        return Result(inserted_ids=ids)
+
+    def bulk_write(self, ops, ordered=True):  # pylint: disable=unused-argument
+        """Apply upserts by replacing whole documents"""
+        for op in ops:
+            # pylint: disable-next=protected-access
+            key, doc = op._filter.get("_id", next(self.counter)), op._doc
+            self.docs[key] = dict(doc, _id=key)
+        return Result(bulk_api_result={})
+
+    def find(self, query=None, projection=None):  # pylint: disable=unused-argument
+        """Linear scan"""
+        query = query or {}
+        return FakeCursor([doc for doc in self.docs.values() if matches(doc, query)])
+
+    def find_one(self, query=None, projection=None, sort=None):
+        """First match of a linear scan"""
+        cursor = self.find(query, projection)
+        if sort:
+            cursor.sort(*sort[0])
+        return next(iter(cursor), None)
+
+    def count_documents(self, query):
+        """Count matches"""
+        return sum(1 for doc in self.docs.values() if matches(doc, query))
+
+    def estimated_document_count(self):
+        """Count everything"""
+        return len(self.docs)
+
+    def delete_many(self, query):
+        """Delete matches"""
+        if list(query) == ["_id"] and list(query["_id"]) == ["$in"]:
+            doomed = [key for key in query["_id"]["$in"] if key in self.docs]
+        else:
+            doomed = [key for key, doc in self.docs.items() if matches(doc, query)]
+        for key in doomed:
+            del self.docs[key]
+        return Result(deleted_count=len(doomed))
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""This script benchmarks the solar collector hot paths against local stand-ins"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import argparse
+import tracemalloc
+from time import perf_counter, time
+from rich import box
+from rich.console import Console
+from rich.table import Table
+from utils import archive, httpclient, poller, prune, weather, writer
+from utils.metrics import percentile
+from utils.poller import Site, sweep
+from utils.prune import Pruner
+from utils.writer import BufferedWriter
+from utils.history import History
+from bench.fakes import FakeApiServer, FakeCollection
+from solarstat import solarstat, build_record
+
+console = Console()
+
+RETENTION = 345600
+
+
+def timed(func, *args):
+    """Seconds one call takes"""
+    start = perf_counter()
+    func(*args)
+    return perf_counter() - start
+
+
+def setup_weather_cold(size, _env):
+    """Every system in its own zip code, nothing cached"""
+
+    def run():
+        weather.CACHE["entries"] = {}
+        return [
+            timed(weather.weather, "bench", f"{zip_code:05d},us", "imperial")
+            for zip_code in range(size)
+        ]
+
+    return run
+
+
+def setup_weather_cached(size, _env):
+    """Every system in its own zip code, all already cached"""
+    weather.CACHE["entries"] = {}
+    for zip_code in range(size):
+        weather.weather("bench", f"{zip_code:05d},us", "imperial")
+
+    def run():
+        return [
+            timed(weather.weather, "bench", f"{zip_code:05d},us", "imperial")
+            for zip_code in range(size)
+        ]
+
+    return run
+
+
+def setup_fleet_weather(size, _env):
+    """Systems 1 km apart, grouped into weather cells, nothing cached"""
+    cells = {
+        str(system): weather.location_cell(lat=37 + system * 0.01, lon=-122)
+        for system in range(size)
+    }
+
+    def run():
+        weather.CACHE["entries"] = {}
+        return [timed(weather.fleet_weather, "bench", cells, "imperial")]
+
+    return run
+
+
+def setup_solarstat(size, _env):
+    """One blocking summary request per system, as a single-site install does"""
+    urls = [
+        poller.ENPHASE_URL.format(system=system) + "?key=bench&user_id=bench"
+        for system in range(size)
+    ]
+
+    def run():
+        return [timed(solarstat, url, {}, {}) for url in urls]
+
+    return run
+
+
+def setup_sweep(size, _env):
+    """One concurrent fleet sweep"""
+    sites = [Site(str(system), f"key{system % 10}", "bench") for system in range(size)]
+
+    def run():
+        return [timed(sweep, sites)]
+
+    return run
+
+
+def setup_history(size, _env):
+    """Fill a day of samples per system, then ask for every trend and anomaly"""
+    now = int(time())
+    store = History()
+    for step in range(store.capacity):
+        for system in range(size):
+            store.add(str(system), now, now - 900 * step, 10000 - step, True, "normal")
+
+    def run():
+        return [
+            timed(
+                lambda: [
+                    (store.trend(str(system)), store.anomalies(str(system), now))
+                    for system in range(size)
+                ]
+            )
+        ]
+
+    return run
+
+
+def setup_insert(size, env):
+    """Shape one poll of every system into documents and flush them"""
+    now = int(time())
+    summary = {"last_report_at": now - 600, "energy_today": 12345, "status": "normal"}
+
+    def run():
+        bulk = BufferedWriter(env["collection"]("insert"), max_buffer=size + 1)
+
+        def cycle():
+            for system in range(size):
+                bulk.add(build_record(str(system), summary, now, 800))
+            bulk.flush()
+
+        return [timed(cycle)]
+
+    return run
+
+
+def setup_prune(size, env):
+    """Delete one expired sample per system while keeping a current one"""
+    now = int(time())
+
+    def run():
+        collection = env["collection"]("prune")
+        collection.insert_many(
+            [
+                {"System": str(system), "EpochLastReport": epoch}
+                for system in range(size)
+                for epoch in (now - RETENTION - 3600, now)
+            ]
+        )
+        pruner = Pruner(collection, RETENTION, max_rate=10 ** 9)
+        return [timed(pruner.prune)]
+
+    return run
+
+
+SCENARIOS = {
+    "weather cold": setup_weather_cold,
+    "weather cached": setup_weather_cached,
+    "fleet weather": setup_fleet_weather,
+    "solarstat": setup_solarstat,
+    "fleet sweep": setup_sweep,
+    "history": setup_history,
+    "insert": setup_insert,
+    "prune": setup_prune,
+}
+
+
+def measure(setup, size, repeat, env):
+    """Run a scenario ``repeat`` times, then once more under tracemalloc
+
+    Returns:
+        dict: ops/s, p50 and p99 in milliseconds and peak KiB allocated
+    """
+    run = setup(size, env)
+    samples = []
+    elapsed = 0
+    for _ in range(repeat):
+        start = perf_counter()
+        samples.extend(run())
+        elapsed += perf_counter() - start
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    samples.sort()
+    return {
+        "ops": size * repeat / elapsed,
+        "p50": percentile(samples, 0.50) * 1000,
+        "p99": percentile(samples, 0.99) * 1000,
+        "peak": peak / 1024,
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", default="1,100,10000", help="comma separated system counts"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario")
+    parser.add_argument(
+        "--scenario", action="append", choices=SCENARIOS, help="only these scenarios"
+    )
+    parser.add_argument(
+        "--mongo", help="local MongoDB URI, instead of an in-memory collection"
+    )
+    args = parser.parse_args()
+
+    start_time = time()
+
+    server = FakeApiServer()
+    weather.WEATHER_URL = server.url + "/data/2.5/weather?"
+    poller.ENPHASE_URL = server.url + "/api/v2/systems/{system}/summary"
+    weather.configure_cache(ttl=900)
+
+    for module in (archive, httpclient, poller, prune, weather, writer):
+        module.console.quiet = True
+
+    if args.mongo:
+        from pymongo import MongoClient
+
+        database = MongoClient(args.mongo)["enlighten_bench"]
+
+        def collection(name):
+            """Empty collection on the local server"""
+            database.drop_collection(name)
+            return database[name]
+
+    else:
+
+        def collection(name):  # pylint: disable=unused-argument
+            """Empty in-memory collection"""
+            return FakeCollection()
+
+    env = {"collection": collection}
+
+    bench_table = Table(title="Benchmark", box=box.SIMPLE, style="cyan")
+
+    bench_table.add_column("Scenario", style="cyan3")
+    for column in ("Systems", "Ops/s", "p50 ms", "p99 ms", "Peak KiB"):
+        bench_table.add_column(column, justify="right", style="cyan3")
+
+    try:
+        for name in args.scenario or SCENARIOS:
+            for size in [int(size) for size in args.sizes.split(",")]:
+                console.log(f"--- Running [bold cyan]{name}[/] x {size} ---")
+                result = measure(SCENARIOS[name], size, args.repeat, env)
+                bench_table.add_row(
+                    name,
+                    str(size),
+                    f"{result['ops']:,.0f}",
+                    f"{result['p50']:.3f}",
+                    f"{result['p99']:.3f}",
+                    f"{result['peak']:,.0f}",
+                )
+    finally:
+        server.close()
+
+    console.print(bench_table)
+
+    console.log(
+        f"--- Script ran in [bold cyan]{(time() - start_time):.3f} seconds[/bold cyan] ---"
+    )
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""This script runs the solar collector and the LEDs in one long-lived process"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import argparse
+import configparser
+import importlib
+import logging
+import os
+import signal
+import sys
+from rich.console import Console
+from utils.logs import setup_logging, headless_consoles
+from utils.metrics import serve
+from utils.mongo import connect
+from utils.scheduler import Scheduler
+
+console = Console()
+
+# Role -> module whose start(config, client, scheduler) sets the role up.
+# Modules are only imported for the roles that run.
+ROLES = {"collector": "solarstat", "lites": "lites"}
+
+
+def read_config(path):
+    """Parse config.ini"""
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+
+def role_names(config, requested=None):
+    """Roles from the command line, else [DAEMON] roles"""
+    if requested:
+        return requested
+    roles = config.get("DAEMON", "roles", fallback="collector,lites")
+    return [role.strip() for role in roles.split(",") if role.strip() in ROLES]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--config", default="config.ini", help="config file")
+    parser.add_argument(
+        "--role", action="append", choices=ROLES, help="roles to run, repeatable"
+    )
+    args = parser.parse_args()
+
+    config = read_config(args.config)
+    roles = role_names(config, args.role)
+    modules = {role: importlib.import_module(ROLES[role]) for role in roles}
+    setup_logging(config)
+
+    metrics_port = config.getint("METRICS", "daemon_port", fallback=0)
+    if metrics_port:
+        serve(metrics_port, config.get("METRICS", "host", fallback="127.0.0.1"))
+
+    # One client for every role, with the shortest timeout any of them needs;
+    # the LED role retries until its own MAX_MONGODB_DELAY has passed
+    client = connect(
+        config, min(module.MAX_MONGODB_DELAY for module in modules.values())
+    )
+    scheduler = Scheduler()
+    reloads = {
+        role: module.start(config, client, scheduler)
+        for role, module in modules.items()
+    }
+    headless_consoles()
+
+    state = {"mtime": os.path.getmtime(args.config), "force": False}
+
+    def reload_config():
+        """Re-read config.ini when it changes or after a SIGHUP"""
+        mtime = os.path.getmtime(args.config)
+        if mtime == state["mtime"] and not state["force"]:
+            return
+        state["mtime"], state["force"] = mtime, False
+        new_config = read_config(args.config)
+        logging.getLogger().setLevel(
+            new_config.get("LOGGING", "level", fallback="INFO").upper()
+        )
+        for role, reload in reloads.items():
+            reload(new_config)
+            console.log(f"[green]--- Reloaded {role} settings ---[/]")
+
+    def request_reload(*_):
+        """Reload on the next check; a signal handler must not take locks"""
+        state["force"] = True
+
+    def shut_down(*_):
+        """Exit cleanly so buffered writes are flushed and the LEDs released"""
+        sys.exit(0)
+
+    signal.signal(signal.SIGHUP, request_reload)
+    signal.signal(signal.SIGTERM, shut_down)
+
+    scheduler.add(
+        "config reload",
+        reload_config,
+        config.getint("DAEMON", "reload_interval", fallback=30),
+    )
+
+    console.log(f"--- Running [bold cyan]{', '.join(roles)}[/bold cyan] ---")
+    scheduler.run_forever()
@@ -8,18 +8,75 @@ __version__ = "0.2.0"
 __copyright__ = "Copyright (c) 2021 Aaron Davis"
 __license__ = "MIT License"
 
+import atexit
 import configparser
-from datetime import datetime, timedelta
-from time import time, sleep
+import os
+from datetime import datetime, timedelta, timezone
+from time import sleep, time
 import sys
-from RPi import GPIO
-import certifi
-from pymongo import MongoClient
+from bson import ObjectId
 from pymongo.errors import ServerSelectionTimeoutError
 from rich import box
 from rich.console import Console
 from rich.table import Table
-from utils.weather import weather
+from utils.weather import weather, configure_cache
+from utils.scheduler import Scheduler
+from utils.watch import RecordWatcher
+from utils.fanout import GROUP, PORT, StatusListener
+from utils.leds import create_driver
+from utils.rollup import Rollup, lag_percentile, uptime
+from utils.status import StatusBoard
+from utils.history import History
+from utils.profiling import Profiler, ProfiledCollection
+from utils.metrics import LED_LAG_SECONDS, MONGO_SECONDS, serve
+from utils.logs import setup_logging
+from utils.mongo import connect
+
+console = Console()
+
+BLUE = 18
+RED = 23
+GREEN = 25
+WHITE = 12
+YELLOW = 20
+HALT = 26
+
+CONFIG_FILE = "./config.ini"
+
+# Milliseconds MongoDB may be unreachable before the LEDs blink red
+MAX_MONGODB_DELAY = 30000
+
+
+def ingest_time(record):
+    """Epoch a record landed in MongoDB, or None if it cannot be told"""
+    updated = record.get("Updated")
+    if isinstance(updated, datetime):
+        # pymongo returns naive datetimes that are in UTC
+        if updated.tzinfo is None:
+            updated = updated.replace(tzinfo=timezone.utc)
+        return updated.timestamp()
+    if isinstance(record.get("_id"), ObjectId):
+        return record["_id"].generation_time.timestamp()
+    return None
+
+
+def wait_for_server(client, patience=MAX_MONGODB_DELAY / 1000):
+    """Ping MongoDB until it answers or ``patience`` seconds have passed
+
+    The shared client may fail server selection much sooner, so a brief
+    network blip is retried rather than shown as an outage.
+
+    Raises:
+        ServerSelectionTimeoutError: Still unreachable after ``patience``
+    """
+    deadline = time() + patience
+    while True:
+        try:
+            return client.server_info()
+        except ServerSelectionTimeoutError:
+            if time() >= deadline:
+                raise
+            sleep(1)
 
 
 def format_time(in_time):
@@ -27,115 +84,129 @@ def format_time(in_time):
     return in_time.strftime("%H").lstrip("0") + in_time.strftime(":%M")
 
 
-if __name__ == "__main__":
-
-    start_time = time()
-    FIRST_RUN = True
-
-    console = Console()
-
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setwarnings(False)
-
-    BLUE = 18
-    RED = 23
-    GREEN = 25
-    WHITE = 12
-    YELLOW = 20
-    HALT = 26
-
-    GPIO.setup(BLUE, GPIO.OUT)
-    GPIO.setup(RED, GPIO.OUT)
-    GPIO.setup(GREEN, GPIO.OUT)
-    GPIO.setup(WHITE, GPIO.OUT)
-    GPIO.setup(YELLOW, GPIO.OUT)
-    GPIO.setup(HALT, GPIO.OUT)
+def start(config, client, scheduler):
+    """Set up the LEDs and add their jobs to a scheduler
+
+    Args:
+        config (ConfigParser): Parsed config.ini
+        client (MongoClient): Shared MongoDB client
+        scheduler (Scheduler): Scheduler the LED and weather jobs run on
+
+    Returns:
+        function: Applies a re-read config.ini to the running LED job
+    """
+    leds = create_driver(
+        {
+            "blue": BLUE,
+            "red": RED,
+            "green": GREEN,
+            "white": WHITE,
+            "yellow": YELLOW,
+            "halt": HALT,
+        },
+        backend=config.get("LITES", "gpio", fallback="auto"),
+    )
 
-    CONFIG_FILE = "./config.ini"
+    atexit.register(leds.close)
 
-    config = configparser.ConfigParser()
-    config.read(CONFIG_FILE)
-    mongoaddr = config["MONGO"]["mongo_addr"]
     mongodb = config["MONGO"]["mongo_db"]
     mongocollect = config["MONGO"]["mongo_collect"]
-    mongouser = config["MONGO"]["user_name"]
-    mongopw = config["MONGO"]["password"]
     api = config["WEATHER"]["weather_api"]
     zip_code = config["WEATHER"]["zip"]
     units = config["WEATHER"]["units"]
-
-    MAX_MONGODB_DELAY = 30000
-
-    client = MongoClient(
-        "mongodb+srv://"
-        + mongouser
-        + ":"
-        + mongopw
-        + "@"
-        + mongoaddr
-        + "/"
-        + mongodb
-        + "?retryWrites=true&w=majority",
-        tlsCAFile=certifi.where(),
-        serverSelectionTimeoutMS=MAX_MONGODB_DELAY,
+    configure_cache(
+        ttl=config.getint("WEATHER", "cache_ttl", fallback=900),
+        path=config.get("WEATHER", "cache_file", fallback=None),
     )
 
     db = client[mongodb]
     collection = db[mongocollect]
+    profiler = None
+    if config.getboolean("PROFILE", "enabled", fallback=False):
+        profiler = Profiler(
+            os.path.join(
+                config.get("PROFILE", "report_dir", fallback="profile"), "lites.json"
+            ),
+            slow_ms=config.getint("PROFILE", "slow_ms", fallback=100),
+            explain_interval=config.getint(
+                "PROFILE", "explain_interval", fallback=3600
+            ),
+        )
+        collection = ProfiledCollection(collection, profiler)
+    status_board = StatusBoard(
+        db, config.get("MONGO", "status_collect", fallback=mongocollect + "_status")
+    )
+    default_system = config.get("DEFAULT", "system", fallback="").split(",")[0]
+    system = config.get("LITES", "system", fallback=default_system).strip() or None
+    rollup = Rollup(
+        db, config.get("MONGO", "rollup_prefix", fallback=mongocollect + "_rollup")
+    )
 
-    while True:
+    def refresh_weather():
+        """Refresh day/night and cloud cover for the LED job"""
+        conditions["localviz"], conditions["collect"] = weather(api, zip_code, units)
 
-        console.log(f"--- First run is : [bold cyan]{FIRST_RUN}[/bold cyan] ---")
+    def blink_halt():
+        """Toggle the halt LED, one step of the red blink"""
+        blink["on"] = not blink["on"]
+        leds.set(HALT, blink["on"])
 
-        if FIRST_RUN is False:
-            start_time = time()
+    def update_leds(record=None):
+        """Set the LEDs from a solar record, reading the latest one if none given"""
+        start_time = time()
 
         CONNECTION = True
 
         console.log("[bold green]--- Recycle for new data ---[/bold green]")
         now = datetime.now().strftime("%m-%d-%Y %I:%M:%S %p")
         console.log(f"--- Current time: {now} ---")
-        GPIO.output(BLUE, GPIO.LOW)
-        GPIO.output(GREEN, GPIO.LOW)
-        GPIO.output(RED, GPIO.LOW)
-        GPIO.output(WHITE, GPIO.LOW)
-        GPIO.output(YELLOW, GPIO.LOW)
+        leds.stage(BLUE, False)
+        leds.stage(GREEN, False)
+        leds.stage(RED, False)
+        leds.stage(WHITE, False)
+        leds.stage(YELLOW, False)
         console.log("[bold bright_yellow]--- LED's off! ----[/bold bright_yellow]")
 
-        localviz, collect = weather(api, zip_code, units)
+        localviz, collect = conditions.get("localviz"), conditions.get("collect")
+
+        if record is None and watcher is not None and watcher.active:
+            record = watcher.latest
 
         if localviz == "day" and collect == "sun":
-            GPIO.output(WHITE, GPIO.HIGH)
-            try:
-                startime = time()
-                info = client.server_info()
-                POST_CONNECT = time() - startime
-                connect_seconds = int(POST_CONNECT)
-                connect_milli = int((POST_CONNECT * 60) % 60)
-                CONNECT_TIME = str(f"{connect_seconds:02}.{connect_milli:02}")
-                GPIO.output(BLUE, GPIO.HIGH)
-            except ServerSelectionTimeoutError:
-                console.log("--- Server not available ---")
-                GPIO.output(BLUE, GPIO.LOW)
-                GPIO.output(GREEN, GPIO.LOW)
-                GPIO.output(RED, GPIO.LOW)
-                GPIO.output(WHITE, GPIO.LOW)
-                GPIO.output(YELLOW, GPIO.LOW)
-                console.log("[red]--- Blinking red ---[/red]")
-                for y in range(30):
-                    GPIO.output(HALT, GPIO.HIGH)
-                    sleep(1)
-                    GPIO.output(HALT, GPIO.LOW)
-                    sleep(1)
-                CONNECTION = False
-
-            if CONNECTION is True:
-
-                lastrecord = collection.find().sort("_id", -1).limit(1)
-                for x in lastrecord:
-                    sysup = x["Reporting"]
-                    collected = x["Collected"]
-                    lastreport = x["EpochLastReport"]
+            leds.stage(WHITE, True)
+            if record is not None:
+                CONNECT_TIME = watcher.source
+                leds.stage(BLUE, True)
+            else:
+                try:
+                    startime = time()
+                    wait_for_server(client)
+                    POST_CONNECT = time() - startime
+                    MONGO_SECONDS.observe(POST_CONNECT, op="server_info")
+                    CONNECT_TIME = f"{POST_CONNECT:.3f}"
+                    leds.stage(BLUE, True)
+                    record = status_board.latest(system) or next(
+                        collection.find().sort("_id", -1).limit(1), None
+                    )
+                except ServerSelectionTimeoutError:
+                    console.log("--- Server not available ---")
+                    leds.stage(BLUE, False)
+                    leds.stage(GREEN, False)
+                    leds.stage(RED, False)
+                    leds.stage(WHITE, False)
+                    leds.stage(YELLOW, False)
+                    console.log("[red]--- Blinking red ---[/red]")
+                    scheduler.add("blink", blink_halt, 1, count=60)
+                    CONNECTION = False
+
+            if CONNECTION is True and record is None:
+                console.log("[i]--- No data... ---[/i]")
+
+            elif CONNECTION is True:
+
+                sysup = record["Reporting"]
+                collected = record["Collected"]
+                lastreport = record["EpochLastReport"]
 
                 lrd = time() - lastreport
                 REPORTED_DIFF = str(timedelta(seconds=lrd)).split(".", maxsplit=1)[0]
@@ -152,63 +223,155 @@ if __name__ == "__main__":
                 db_stats_table.add_row("Energy collected", str(collected))
                 db_stats_table.add_row("Since last report", str(REPORTED_DIFF))
 
+                # Records written before systems were tracked carry no System
+                if record.get("System") is not None:
+                    history.extend([record], int(time()))
+                    trend = history.trend(record["System"])
+                    if trend is not None:
+                        db_stats_table.add_row("Energy trend (Wh/h)", f"{trend:.0f}")
+
+                # Multicast spares MongoDB entirely; its records carry no rollup
+                today = None
+                if CONNECT_TIME != StatusListener.source:
+                    today = rollup.day(record.get("System"), lastreport)
+                if today:
+                    db_stats_table.add_row("Uptime today", f"{uptime(today):.0%}")
+                    db_stats_table.add_row(
+                        "Report lag p95 (s)", str(lag_percentile(today, 0.95))
+                    )
+
                 if db_stats_table.columns:
                     console.print(db_stats_table)
                 else:
                     console.log("[i]--- No data... ---[/i]")
 
                 if sysup is True:
-                    GPIO.output(GREEN, GPIO.HIGH)
+                    leds.stage(GREEN, True)
                     console.log("[bold green]--- Green LED on! ---[/bold green]")
                     console.log("[bold green]--- System Up! ---[/bold green]")
-                    sleep(10)
                 else:
-                    GPIO.output(RED, GPIO.HIGH)
+                    leds.stage(RED, True)
                     console.log("[bold red]--- Red LED on! ----[/bold red]")
                     console.log("[bold red]--- System Down! ----[/bold red]")
-                    sleep(10)
 
                 if lrd > 86400:
-                    GPIO.output(RED, GPIO.HIGH)
+                    leds.stage(RED, True)
                     console.log("[bold red]--- Red LED on! ----[/bold red]")
                     console.log("[bold red]--- System Reporting Delay! ---[/bold red]")
                 else:
-                    GPIO.output(WHITE, GPIO.HIGH)
+                    leds.stage(WHITE, True)
                     console.log("[bold white]--- White LED on! ----[/bold white]")
                     console.log(
                         "[bold white]--- System Reporting Timely! ---[/bold white]"
                     )
         else:
-            GPIO.output(YELLOW, GPIO.HIGH)
+            leds.stage(YELLOW, True)
             console.log(
                 "[bold bright_yellow]--- Waiting for sun! ---[/bold bright_yellow]"
             )
             console.log("[bright_yellow]--- Yellow LED on! ----[/bright_yellow]")
 
-        instant = datetime.now()
-        nextpoll = instant + timedelta(minutes=60)
-        instup = instant.timetuple()
+        leds.commit()
 
-        now = datetime.now()
+        # Lag runs from a record landing to its first display; periodic
+        # updates that show it again would only measure its age
+        if record is not None and ingest_time(record) is not None:
+            key = (record.get("System"), record.get("EpochLastReport"))
+            if key != shown.get("key"):
+                shown["key"] = key
+                LED_LAG_SECONDS.observe(max(0, time() - ingest_time(record)))
 
         console.log(
             f"--- Script ran in [bold cyan]{(time() - start_time):.3f}[/bold cyan] seconds ---"
         )
 
-        FIRST_RUN = False
+    def on_insert(record):
+        """Show a record from the change stream on the next scheduler tick"""
+        scheduler.add("LED change", lambda: update_leds(record), 1, count=1)
+
+    conditions = {}
+    blink = {"on": False}
+    shown = {}
+    history = History(config.getint("HISTORY", "capacity", fallback=96))
+
+    watcher = None
+    mode = config.get("LITES", "mode", fallback="poll")
+    if mode == "watch":
+        watcher = RecordWatcher(
+            status_board.collection,
+            on_insert,
+            token_path=config.get("LITES", "resume_file", fallback=None),
+            system=system,
+        )
+        watcher.start()
+    elif mode == "multicast":
+        watcher = StatusListener(
+            on_insert,
+            group=config.get("FANOUT", "group", fallback=GROUP),
+            port=config.getint("FANOUT", "port", fallback=PORT),
+            system=system,
+            # Three missed heartbeats before falling back to MongoDB
+            stale=config.getint(
+                "FANOUT",
+                "stale",
+                fallback=3 * config.getint("FANOUT", "heartbeat", fallback=300),
+            ),
+            interface=config.get("FANOUT", "interface", fallback="0.0.0.0"),
+        )
+        watcher.start()
+    scheduler.add(
+        "LED weather refresh",
+        refresh_weather,
+        config.getint("SCHEDULE", "weather_interval", fallback=900),
+        jitter=30,
+    )
+    if profiler is not None:
+        atexit.register(profiler.write)
+        scheduler.add(
+            "LED profile report",
+            profiler.write,
+            config.getint("PROFILE", "report_interval", fallback=300),
+        )
+    scheduler.add(
+        "LED update",
+        update_leds,
+        config.getint("SCHEDULE", "led_interval", fallback=1800),
+        jitter=config.getint("SCHEDULE", "jitter", fallback=60),
+    )
 
-        console.log(
-            f"--- Next poll in 30 minutes: {format_time(now + timedelta(minutes=30))} ---"
+    def reload(config):
+        """Apply the tunable settings of a re-read config.ini
+
+        Intervals and the weather cache lifetime change in place. Pins,
+        the GPIO backend, the watch or multicast mode and the system shown
+        need a restart.
+        """
+        configure_cache(ttl=config.getint("WEATHER", "cache_ttl", fallback=900))
+        scheduler.update(
+            "LED weather refresh",
+            interval=config.getint("SCHEDULE", "weather_interval", fallback=900),
+        )
+        scheduler.update(
+            "LED update",
+            interval=config.getint("SCHEDULE", "led_interval", fallback=1800),
+            jitter=config.getint("SCHEDULE", "jitter", fallback=60),
         )
 
-        with console.status(
-            "[bold green]Sleeping for 30 minutes...", spinner="dots12"
-        ) as status:
-            sleep(1800)
-            console.log(
-                "[green]Finished sleeping for [/green] 30 [green]minutes[/green]"
-            )
+    return reload
+
+
+if __name__ == "__main__":
+
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE)
+    setup_logging(config)
 
-            console.log("[bold][red]Done![/]")
+    metrics_port = config.getint("METRICS", "lites_port", fallback=0)
+    if metrics_port:
+        serve(metrics_port, config.get("METRICS", "host", fallback="127.0.0.1"))
 
-    GPIO.cleanup()
+    # Following multicast, MongoDB is only a fallback and connects on first use
+    lazy = config.get("LITES", "mode", fallback="poll") == "multicast"
+    scheduler = Scheduler()
+    start(config, connect(config, MAX_MONGODB_DELAY, lazy=lazy), scheduler)
+    scheduler.run_forever()
@@ -6,58 +6,263 @@ __version__ = "0.1.5"
 __copyright__ = "Copyright (c) 2021 Aaron Davis"
 __license__ = "MIT License"
 
+import atexit
 import configparser
-import json
 import logging
-from time import time, sleep
-from datetime import datetime, timedelta
-import requests
-import certifi
-import pymongo
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+import os
+from time import time
+from datetime import datetime, timezone
+from requests.exceptions import RequestException
 from rich import print, box  # pylint: disable=redefined-builtin
 from rich.console import Console
 from rich.table import Table
-from rich.logging import RichHandler
-from utils.weather import weather
-
-if __name__ == "__main__":
+from utils.weather import (
+    weather,
+    weather_id,
+    configure_cache,
+    fleet_weather,
+    site_cells,
+)
+from utils.httpclient import get, log_latency
+from utils.poller import load_sites, sweep
+from utils.writer import BufferedWriter
+from utils.spool import Spool
+from utils.rollup import Rollup
+from utils.status import StatusBoard
+from utils.fanout import GROUP, PORT, StatusPublisher
+from utils.history import History
+from utils.profiling import Profiler, ProfiledCollection
+from utils.schema import bootstrap
+from utils.prune import Pruner
+from utils.scheduler import Scheduler
+from utils.policy import PollPolicy
+from utils.metrics import serve
+from utils.logs import setup_logging
+from utils.mongo import connect
+from utils.shard import ShardPool
+from utils.backfill import Backfill
+
+console = Console()
+
+# Server selection timeout, kept short so a write never stalls a poll
+MAX_MONGODB_DELAY = 500
+
+
+def solarstat(url, headers, payload):
+    """API call to get solar summary data
+
+    Args:
+        url (str): Enphase API URL string
+        headers (str): URL headers
+        payload (str): URL query parameters
+
+    Returns:
+        json: Solar summary, or None if the request failed
+    """
+    try:
+        response = get(url, "enphase", headers=headers, params=payload)
+        response.raise_for_status()
+    except RequestException as error:
+        logging.getLogger("solarstat").exception(error)
+        return None
+    return response.json()
+
+
+def build_record(system, respjson, current_epoch, weather_code=None):
+    """Shape an Enphase summary response into a MongoDB document
+
+    Args:
+        system (str): Enphase system id
+        respjson (dict): Summary endpoint response
+        current_epoch (int): Poll time
+        weather_code (int): OpenWeather condition id at poll time
+
+    Returns:
+        dict: Document ready for insertion
+    """
+    epochlastreport = respjson["last_report_at"]
+    lastreportdelta = (current_epoch - epochlastreport) / 60
+
+    record = {
+        "System": system,
+        "EpochLastReport": epochlastreport,
+        # BSON dates are UTC; a naive local time would shift buckets and expiry
+        "LastReport": datetime.fromtimestamp(int(epochlastreport), timezone.utc),
+        "Collected": respjson["energy_today"],
+        "Status": respjson["status"],
+        "Reporting": lastreportdelta < 86400,  # 24 hours
+    }
+    if weather_code is not None:
+        record["WeatherId"] = weather_code
+    return record
+
+
+def poller_options(config):
+    """Fleet sweep settings from the [POLLER] section"""
+    max_connections = config.getint("POLLER", "max_connections", fallback=50)
+    return {
+        "per_key": config.getint("POLLER", "per_key", fallback=2),
+        "max_connections": max_connections,
+        "per_host": config.getint("POLLER", "per_host", fallback=max_connections),
+        "timeout": config.getint("POLLER", "timeout", fallback=10),
+        "retries": config.getint("POLLER", "retries", fallback=3),
+    }
+
+
+def pipeline(config, db, spool_dir, collection=None):
+    """Start the write buffer and open the rollups and status board
+
+    The buffer writes to ``collection``, the [MONGO] mongo_collect
+    collection when not given.
+
+    Returns:
+        tuple: (BufferedWriter, Rollup, StatusBoard)
+    """
+    mongocollect = config["MONGO"]["mongo_collect"]
+    writer = BufferedWriter(
+        db[mongocollect] if collection is None else collection,
+        max_docs=config.getint("WRITER", "max_docs", fallback=500),
+        max_delay=config.getint("WRITER", "max_delay", fallback=60),
+        max_buffer=config.getint("WRITER", "max_buffer", fallback=10000),
+        spool=Spool(spool_dir),
+        dead_letter=Spool(
+            os.path.join(spool_dir, "rejected"), queue="rejected_spool_segments"
+        ),
+    )
+    writer.start()
 
-    start_time = time()
-    FIRST_RUN = True
+    rollup = Rollup(
+        db,
+        config.get("MONGO", "rollup_prefix", fallback=mongocollect + "_rollup"),
+        spool=Spool(os.path.join(spool_dir, "rollup"), queue="rollup_spool_segments"),
+    )
 
-    console = Console()
+    fanout = None
+    if config.getboolean("FANOUT", "enabled", fallback=False):
+        fanout = StatusPublisher(
+            group=config.get("FANOUT", "group", fallback=GROUP),
+            port=config.getint("FANOUT", "port", fallback=PORT),
+            ttl=config.getint("FANOUT", "ttl", fallback=1),
+            heartbeat=config.getint("FANOUT", "heartbeat", fallback=300),
+            interface=config.get("FANOUT", "interface", fallback="0.0.0.0"),
+        )
+        fanout.start()
 
-    FORMAT = "%(message)s"
-    logging.basicConfig(
-        level="NOTSET", format=FORMAT, datefmt="[%X]", handlers=[RichHandler()]
+    status_board = StatusBoard(
+        db,
+        config.get("MONGO", "status_collect", fallback=mongocollect + "_status"),
+        fanout=fanout,
     )
+    return (writer, rollup, status_board)
 
-    logging.basicConfig(
-        level="NOTSET",
-        format="%(message)s",
-        datefmt="[%X]",
-        handlers=[RichHandler(rich_tracebacks=True)],
-    )
 
-    log = logging.getLogger("rich")
+def ingest(docs, current_epoch, writer, rollup, status_board):
+    """Queue a sweep's documents and update the rollups and status board
 
+    Returns:
+        int: Documents accepted by the write buffer
+    """
+    accepted = writer.extend(docs)
+    if accepted < len(docs):
+        console.log(
+            f"[red]--- {len(docs) - accepted} records refused, write buffer full ---[/]"
+        )
+    writer.maybe_flush()
+    status_board.publish(docs)
+    rollup.apply(docs, current_epoch)
+    return accepted
+
+
+def shard_worker(name, settings, inbox, outbox):
+    """Poll and store one shard of the fleet, run in its own process
+
+    Each worker has its own MongoClient, HTTP pool, write buffer and spool
+    directory, so JSON parsing and BSON encoding scale with cores.
+
+    Args:
+        name (str): Shard name, also the spool subdirectory
+        settings (dict): config.ini as a dict of sections
+        inbox (Queue): Messages from the ShardPool
+        outbox (Queue): Sweep results for the ShardPool
+    """
     config = configparser.ConfigParser()
-    config.read("config.ini")
-    key = config["DEFAULT"]["key"]
-    user = config["DEFAULT"]["user_id"]
-    system = config["DEFAULT"]["system"]
-    mongoaddr = config["MONGO"]["mongo_addr"]
+    config.read_dict(settings)
+    setup_logging(config)
+    db = connect(config, MAX_MONGODB_DELAY)[config["MONGO"]["mongo_db"]]
+    writer, rollup, status_board = pipeline(
+        config,
+        db,
+        os.path.join(config.get("WRITER", "spool_dir", fallback="spool"), name),
+    )
+    poller_opts = poller_options(config)
+    sites = []
+
+    for message in iter(inbox.get, ("stop",)):
+        if message[0] == "assign":
+            sites = message[1]
+            continue
+        _, cycle, current_epoch, codes = message
+        start_time = time()
+        active = [site for site in sites if site.system in codes]
+        results = sweep(active, **poller_opts)
+        docs = [
+            build_record(site.system, respjson, current_epoch, codes[site.system])
+            for site, respjson in results
+            if respjson is not None
+        ]
+        accepted = ingest(docs, current_epoch, writer, rollup, status_board)
+        outbox.put(
+            (
+                name,
+                cycle,
+                {
+                    "systems": len(active),
+                    "failed": len(results) - len(docs),
+                    "written": accepted,
+                    "seconds": time() - start_time,
+                    "reports": [
+                        (
+                            d["System"],
+                            d["EpochLastReport"],
+                            d["Reporting"],
+                            d["Status"],
+                            d["Collected"],
+                        )
+                        for d in docs
+                    ],
+                },
+            )
+        )
+
+    writer.stop()
+
+
+def start(config, client, scheduler):
+    """Set up the collector and add its jobs to a scheduler
+
+    Args:
+        config (ConfigParser): Parsed config.ini
+        client (MongoClient): Shared MongoDB client
+        scheduler (Scheduler): Scheduler the poll, weather and prune jobs run on
+
+    Returns:
+        function: Applies a re-read config.ini to the running collector
+    """
     mongodb = config["MONGO"]["mongo_db"]
     mongocollect = config["MONGO"]["mongo_collect"]
-    mongouser = config["MONGO"]["user_name"]
-    mongopw = config["MONGO"]["password"]
     api = config["WEATHER"]["weather_api"]
     zip_code = config["WEATHER"]["zip"]
     units = config["WEATHER"]["units"]
+    configure_cache(
+        ttl=config.getint("WEATHER", "cache_ttl", fallback=900),
+        path=config.get("WEATHER", "cache_file", fallback=None),
+    )
 
-    MAX_MONGODB_DELAY = 500
+    sites = load_sites(config)
+    FLEET = len(sites) > 1
+    system, key, user = sites[0]
+    cells = site_cells(config, sites) if FLEET else {}
+    poller_opts = poller_options(config)
 
     url = (
         "https://api.enphaseenergy.com/api/v2/systems/"
@@ -68,188 +273,253 @@ if __name__ == "__main__":
         + user
     )
 
-    client = MongoClient(
-        "mongodb+srv://"
-        + mongouser
-        + ":"
-        + mongopw
-        + "@"
-        + mongoaddr
-        + "/"
-        + mongodb
-        + "?retryWrites=true&w=majority",
-        tlsCAFile=certifi.where(),
-        serverSelectionTimeoutMS=MAX_MONGODB_DELAY,
-    )
-
     db = client[mongodb]
+    schema = bootstrap(
+        db,
+        mongocollect,
+        retention=config.getint("MONGO", "retention", fallback=345600),
+        timeseries=config.getboolean("MONGO", "timeseries", fallback=True),
+    )
     collection = db[mongocollect]
+    profiler = None
+    if config.getboolean("PROFILE", "enabled", fallback=False):
+        profiler = Profiler(
+            os.path.join(
+                config.get("PROFILE", "report_dir", fallback="profile"),
+                "collector.json",
+            ),
+            slow_ms=config.getint("PROFILE", "slow_ms", fallback=100),
+            explain_interval=config.getint(
+                "PROFILE", "explain_interval", fallback=3600
+            ),
+        )
+        collection = ProfiledCollection(collection, profiler)
+    console.log(
+        f"--- Collection layout: [bold cyan]{schema['kind']}[/bold cyan], "
+        f"TTL expiry: [bold cyan]{schema['ttl']}[/bold cyan] ---"
+    )
 
-    payload = {}
-    headers = {}
-
-    def solarstat(url, headers, payload):
-        """API call to get weather data
-
-        Args:
-            url (str): Open Weather API URL string
-            headers (str): URL headers
-            payload (str): URL payload
-
-        Returns:
-            json: Weather information
-        """
-        response = requests.request("GET", url, headers=headers, data=payload)
-        respjson = json.loads(response.text)
-        return respjson
-
-    def dbprune():
-        """Clean up old documents in MongoDB"""
-
-        docs = collection.estimated_document_count()
-
-        t = time()
-        easytime = datetime.fromtimestamp(t)
-        ezytime = int(easytime.timestamp())
-
-        minus = t - 345600  # 4-days
-        easytime2 = datetime.fromtimestamp(minus)
-        ezytime2 = int(easytime2.timestamp())
-
-        deldocs = collection.count_documents({"EpochLastReport": {"$lt": ezytime2}})
+    writer, rollup, status_board = pipeline(
+        config, db, config.get("WRITER", "spool_dir", fallback="spool"), collection
+    )
 
-        before_stats_table = Table(
-            title="Before Statistics", box=box.SIMPLE, style="red"
+    shards = None
+    workers = config.getint("POLLER", "workers", fallback=1)
+    if FLEET and workers > 1:
+        shards = ShardPool(
+            shard_worker,
+            {
+                section: dict(config.items(section))
+                for section in ["DEFAULT"] + config.sections()
+            },
+            sites,
+            workers=workers,
+            timeout=config.getint("POLLER", "shard_timeout", fallback=300),
+            respawn_delay=config.getint("POLLER", "respawn_delay", fallback=60),
         )
+        shards.start()
+        atexit.register(shards.stop)
+
+    archive = None
+    if config.has_option("PRUNE", "archive_dir"):
+        # NumPy is only imported when archiving is configured
+        from utils.archive import Archive  # pylint: disable=import-outside-toplevel
+
+        archive = Archive(config["PRUNE"]["archive_dir"])
+
+    pruner = Pruner(
+        collection,
+        retention=config.getint("MONGO", "retention", fallback=345600),
+        ttl=schema["ttl"],
+        chunk=config.getint("PRUNE", "chunk", fallback=1000),
+        max_rate=config.getint("PRUNE", "max_rate", fallback=5000),
+        archive=archive,
+    )
 
-        before_stats_table.add_column("Type", style="red")
-        before_stats_table.add_column("Data", justify="right", style="red")
-
-        before_stats_table.add_row("Current time", str(ezytime))
-        before_stats_table.add_row("Pruning time", str(ezytime2))
-        before_stats_table.add_row("Number of docs", str(docs))
-        before_stats_table.add_row("Docs to delete", str(deldocs))
+    payload = {}
+    headers = {}
 
-        if before_stats_table.columns:
-            console.print(before_stats_table)
+    def dbprune():
+        """Clean up old documents in MongoDB without blocking the poll loop"""
+        pruner.start()
+
+    def poll_fleet():
+        """Poll every configured system and write the sweep in one batch"""
+        current_epoch = int(time())
+        # Only systems whose weather cell is in daylight with sun are polled
+        codes = {
+            system: code
+            for system, (localviz, collect, code) in conditions["systems"].items()
+            if localviz == "day" and collect == "sun"
+        }
+
+        if shards is not None:
+            stats = shards.sweep(current_epoch, codes).values()
+            shards.log_shards()
+            polled = sum(shard["systems"] for shard in stats)
+            reports = [report for shard in stats for report in shard["reports"]]
         else:
-            print("[i]No data...[/i]")
-
-        try:
-            collection.delete_many({"EpochLastReport": {"$lt": ezytime2}})
-        except ConnectionFailure as delerr:
-            log.exception(delerr)
-
-        newdocs = collection.estimated_document_count()
-        docsdel = docs - newdocs
-
-        after_stats_table = Table(
-            title="After Statistics", box=box.SIMPLE, style="cyan"
+            results = sweep(
+                [site for site in sites if site.system in codes], **poller_opts
+            )
+            docs = [
+                build_record(site.system, respjson, current_epoch, codes[site.system])
+                for site, respjson in results
+                if respjson is not None
+            ]
+            ingest(docs, current_epoch, writer, rollup, status_board)
+            polled = len(results)
+            reports = [
+                (
+                    d["System"],
+                    d["EpochLastReport"],
+                    d["Reporting"],
+                    d["Status"],
+                    d["Collected"],
+                )
+                for d in docs
+            ]
+
+        fresh = [policy.observe(system, epoch) for system, epoch, *_ in reports]
+        for system, epoch, reporting, status, collected in reports:
+            history.add(system, current_epoch, epoch, collected, reporting, status)
+
+        fleet_table = Table(title="Fleet Statistics", box=box.SIMPLE, style="cyan")
+
+        fleet_table.add_column("Type", style="cyan3")
+        fleet_table.add_column("Data", justify="right", style="cyan3")
+
+        fleet_table.add_row("Systems polled", str(polled))
+        fleet_table.add_row("Systems failed", str(polled - len(reports)))
+        fleet_table.add_row(
+            "Systems reporting", str(sum(report[2] for report in reports))
         )
+        fleet_table.add_row(
+            "Systems in comm", str(sum(report[3] == "comm" for report in reports))
+        )
+        fleet_table.add_row("Systems flagged", str(len(history.flagged(current_epoch))))
 
-        after_stats_table.add_column("Type", style="cyan3")
-        after_stats_table.add_column("Data", justify="right", style="cyan3")
-
-        after_stats_table.add_row("Number of docs", str(newdocs))
-        after_stats_table.add_row("Docs deleted", str(docsdel))
-
-        if after_stats_table.columns:
-            console.print(after_stats_table)
+        if fleet_table.columns:
+            console.print(fleet_table)
         else:
             print("[i]No data...[/i]")
 
-        dbprunenext = datetime.now() + timedelta(hours=DB_PRUNE_DELAY)
-        nextrundb = dbprunenext.strftime("%m-%d-%Y %H:%M:%S")
-        console.log(f"--- Next db clean-up run: [bold cyan]{nextrundb}[/bold cyan] ---")
-
-        return dbprunenext
+        return any(fresh)
 
-    def format_time(time):
-        """Format time to make it easier to read"""
-        return time.strftime("%H").lstrip("0") + time.strftime(":%M")
+    def refresh_weather():
+        """Refresh day/night and cloud cover for the poll job
 
-    start_time = time()
+        A fleet gets one request per weather cell. The fleet counts as in
+        daylight with sun when any of its cells is.
+        """
+        if FLEET:
+            systems = fleet_weather(api, cells, units)
+            conditions["systems"] = systems
+            derived = set(systems.values())
+            conditions["localviz"] = (
+                "day" if any(viz == "day" for viz, _, _ in derived) else "night"
+            )
+            conditions["collect"] = (
+                "sun" if any(sun == "sun" for _, sun, _ in derived) else "no sun"
+            )
+        else:
+            conditions["localviz"], conditions["collect"] = weather(
+                api, zip_code, units
+            )
 
-    while True:
+    def poll():
+        """Pull solar data and queue it for MongoDB"""
+        start_time = time()
 
-        console.log(f"--- First run is : [bold cyan]{FIRST_RUN}[/bold cyan] ---")
+        localviz, collect = conditions.get("localviz"), conditions.get("collect")
 
-        if FIRST_RUN is False:
-            start_time = time()
+        fresh = True
 
-        localviz, collect = weather(api, zip_code, units)
+        if localviz == "day" and collect == "sun" and FLEET:
+            fresh = poll_fleet()
 
-        if localviz == "day" and collect == "sun":
+        elif localviz == "day" and collect == "sun":
 
             current_epoch = int(time())
 
             respjson = solarstat(url, headers, payload)
 
-            epochlastreport = respjson["last_report_at"]
-            lastreport = datetime.fromtimestamp(int(respjson["last_report_at"]))
-            status = respjson["status"]
-            collected = respjson["energy_today"]
-
-            lastreportdelta = (current_epoch - epochlastreport) / 60
-
-            minutes = int(lastreportdelta)
-            seconds = int((lastreportdelta * 60) % 60)
-
-            LAST_REPORTED = str(f"{minutes:02}:{seconds:02}")
-
-            IN_RANGE = lastreportdelta < 86400  # 24 hours
-
-            epochdelta = current_epoch - epochlastreport
-
-            coltable = Table(title="Solar Statistics", box=box.SIMPLE, style="cyan")
-
-            coltable.add_column("Type", style="cyan3")
-            coltable.add_column("Data", justify="right", style="cyan3")
-
-            coltable.add_row("Last report (epoch)", str(epochlastreport))
-            coltable.add_row("Current time (epoch)", str(current_epoch))
-            coltable.add_row("Delta (epoch)", str(epochdelta))
-            coltable.add_row("Last reported mins:secs ago", (LAST_REPORTED))
-            coltable.add_row("In range? (<24 hours)", str(IN_RANGE))
-            coltable.add_row("Solar array status", status)
-            coltable.add_row("Energy collected", str(collected))
-
-            if coltable.columns:
-                console.print(coltable)
+            if respjson is None:
+                console.log("[red]--- No solar data received ---[/]")
+                fresh = False
             else:
-                print("[i]No data...[/i]")
-
-            if status == "comm":
-                console.log("[dark_orange]--- Down network connection to cloud! ---[/]")
-
-            try:
-                client.admin.command("ping")
-            except ConnectionFailure as error:
-                log.exception(error)
-
-            try:
-                insert = {
-                    "EpochLastReport": epochlastreport,
-                    "LastReport": lastreport,
-                    "Collected": collected,
-                    "Status": status,
-                    "Reporting": IN_RANGE,
-                }
-
-                post = collection.insert_one(insert)
-
-                if post.inserted_id == 0:
-                    console.log("[green]--- No MongoDB record created ---[/]")
+                epochlastreport = respjson["last_report_at"]
+                status = respjson["status"]
+                collected = respjson["energy_today"]
+
+                lastreportdelta = (current_epoch - epochlastreport) / 60
+
+                minutes = int(lastreportdelta)
+                seconds = int((lastreportdelta * 60) % 60)
+
+                LAST_REPORTED = str(f"{minutes:02}:{seconds:02}")
+
+                IN_RANGE = lastreportdelta < 86400  # 24 hours
+
+                epochdelta = current_epoch - epochlastreport
+
+                coltable = Table(title="Solar Statistics", box=box.SIMPLE, style="cyan")
+
+                coltable.add_column("Type", style="cyan3")
+                coltable.add_column("Data", justify="right", style="cyan3")
+
+                coltable.add_row("Last report (epoch)", str(epochlastreport))
+                coltable.add_row("Current time (epoch)", str(current_epoch))
+                coltable.add_row("Delta (epoch)", str(epochdelta))
+                coltable.add_row("Last reported mins:secs ago", (LAST_REPORTED))
+                coltable.add_row("In range? (<24 hours)", str(IN_RANGE))
+                coltable.add_row("Solar array status", status)
+                coltable.add_row("Energy collected", str(collected))
+
+                history.add(
+                    system,
+                    current_epoch,
+                    epochlastreport,
+                    collected,
+                    IN_RANGE,
+                    status,
+                )
+                trend = history.trend(system)
+                if trend is not None:
+                    coltable.add_row("Energy trend (Wh/h)", f"{trend:.0f}")
+                anomalies = history.anomalies(system, current_epoch)
+                if anomalies:
+                    coltable.add_row("Anomalies", ", ".join(anomalies))
+
+                if coltable.columns:
+                    console.print(coltable)
                 else:
+                    print("[i]No data...[/i]")
+
+                if status == "comm":
                     console.log(
-                        f"[green]--- Created MongoDB record as {post.inserted_id} ---[/]"
+                        "[dark_orange]--- Down network connection to cloud! ---[/]"
                     )
 
-            except pymongo.errors.ServerSelectionTimeoutError as error:
-                log.exception(error)
+                record = build_record(
+                    system, respjson, current_epoch, weather_id(zip_code, units)
+                )
+                writer.add(record)
+                writer.maybe_flush()
+                status_board.publish([record])
+                rollup.apply([record], current_epoch)
+                fresh = policy.observe(system, epochlastreport)
+        elif FLEET:
+            console.log(
+                "[bold bright_yellow] --- Waiting for sun! ---[/bold bright_yellow]"
+            )
+        elif ADAPTIVE:
+            console.log(
+                "[bold bright_yellow] --- Waiting for sun! ---[/bold bright_yellow]"
+            )
         else:
             respjson = solarstat(url, headers, payload)
-            status = respjson["status"]
+            status = respjson["status"] if respjson else "unknown"
             console.log(
                 "[bold bright_yellow] --- Waiting for sun! ---[/bold bright_yellow]"
             )
@@ -257,43 +527,131 @@ if __name__ == "__main__":
                 "[bold bright_yellow] --- Collection status: {status} ---[/bold bright_yellow]"
             )
 
-        DB_PRUNE_DELAY = 24
+        log_latency()
 
-        if FIRST_RUN is True:
-            dbprunenext = datetime.now() + timedelta(hours=DB_PRUNE_DELAY)
-            nextrundb = dbprunenext.strftime("%m-%d-%Y %H:%M:%S")
-            console.log(
-                f"--- Next db clean-up run: [bold cyan]{nextrundb}[/bold cyan] ---"
-            )
+        console.log(
+            f"--- Script ran in [bold cyan]{(time() - start_time):.3f} seconds[/bold cyan] ---"
+        )
 
-        if dbprunenext < datetime.now():
-            dbprunenext = dbprune()
-        else:
-            countdwn = str(dbprunenext - datetime.now()).split(".", maxsplit=1)[0]
-            console.log(
-                f"--- Next db prune in t-minus: [bold cyan]{countdwn}[/bold cyan] ---"
-            )
+        if ADAPTIVE:
+            return policy.next_delay(fresh)
+        return None
 
-        RUN_DELAY = 1
+    DB_PRUNE_DELAY = 24
 
-        ennext = datetime.now() + timedelta(hours=RUN_DELAY)
-        nextrun = ennext.strftime("%m-%d-%Y %H:%M:%S")
-        console.log(f"--- Next solar data pull: [bold cyan]{nextrun}[/bold cyan] ---")
+    ADAPTIVE = config.getboolean("SCHEDULE", "adaptive", fallback=True)
+    policy = PollPolicy(
+        zip_code,
+        units,
+        default=config.getint("SCHEDULE", "poll_interval", fallback=3600),
+        min_delay=config.getint("SCHEDULE", "min_poll_delay", fallback=300),
+        max_delay=config.getint("SCHEDULE", "max_poll_delay", fallback=10800),
+    )
 
-        console.log(
-            f"--- Script ran in [bold cyan]{(time() - start_time):.3f} seconds[/bold cyan] ---"
+    # Recent samples per system, for trends and anomalies without a query
+    history = History(config.getint("HISTORY", "capacity", fallback=96))
+
+    conditions = {}
+    scheduler.add(
+        "weather refresh",
+        refresh_weather,
+        config.getint("SCHEDULE", "weather_interval", fallback=900),
+        jitter=30,
+    )
+    scheduler.add(
+        "solar data pull",
+        poll,
+        config.getint("SCHEDULE", "poll_interval", fallback=3600),
+        align=True,
+        offset=config.getint("SCHEDULE", "poll_offset", fallback=300),
+        jitter=config.getint("SCHEDULE", "jitter", fallback=60),
+    )
+    scheduler.add(
+        "db clean-up run",
+        dbprune,
+        DB_PRUNE_DELAY * 3600,
+        first=time() + DB_PRUNE_DELAY * 3600,
+    )
+
+    if profiler is not None:
+        atexit.register(profiler.write)
+        scheduler.add(
+            "profile report",
+            profiler.write,
+            config.getint("PROFILE", "report_interval", fallback=300),
         )
 
-        FIRST_RUN = False
+    backfill = None
+    if config.getboolean("BACKFILL", "enabled", fallback=False):
+        backfill = Backfill(
+            db,
+            config.get("BACKFILL", "prefix", fallback=mongocollect),
+            max_age=config.getint("BACKFILL", "max_age", fallback=7 * 86400),
+            max_pages=config.getint("BACKFILL", "max_pages", fallback=4),
+            retention=config.getint("MONGO", "retention", fallback=345600),
+        )
 
-        console.log(
-            f"--- Next poll in 1 hour: {format_time(datetime.now() + timedelta(minutes=60))} ---"
+        def run_backfill():
+            """Store the stats intervals each system reported since the last run"""
+            latest = {}
+            for site in sites:
+                sample = history.latest(site.system)
+                if sample is not None:
+                    latest[site.system] = sample.epoch
+            backfill.run(sites, latest, **poller_opts)
+
+        # One stats request per system per run, so this runs far less often
+        # than the summary poll
+        scheduler.add(
+            "interval backfill",
+            run_backfill,
+            config.getint("BACKFILL", "interval", fallback=86400),
+            align=True,
+            offset=config.getint("SCHEDULE", "poll_offset", fallback=300) + 120,
+            jitter=config.getint("SCHEDULE", "jitter", fallback=60),
         )
 
-        with console.status(
-            "[bold green]Sleeping for 1 hour...[/]", spinner="dots12"
-        ) as status:
-            sleep(3600)
-            console.log("[green]Finished sleeping for 1 hour[/green]")
+    def reload(config):
+        """Apply the tunable settings of a re-read config.ini
+
+        Intervals, cache lifetime, poller limits, write thresholds, prune
+        pacing and poll delay bounds change in place. Credentials, systems
+        and collection names need a restart.
+        """
+        configure_cache(ttl=config.getint("WEATHER", "cache_ttl", fallback=900))
+        poller_opts.update(poller_options(config))
+        writer.max_docs = config.getint("WRITER", "max_docs", fallback=500)
+        writer.max_delay = config.getint("WRITER", "max_delay", fallback=60)
+        writer.max_buffer = config.getint("WRITER", "max_buffer", fallback=10000)
+        pruner.chunk = config.getint("PRUNE", "chunk", fallback=1000)
+        pruner.max_rate = config.getint("PRUNE", "max_rate", fallback=5000)
+        policy.default = config.getint("SCHEDULE", "poll_interval", fallback=3600)
+        policy.min_delay = config.getint("SCHEDULE", "min_poll_delay", fallback=300)
+        policy.max_delay = config.getint("SCHEDULE", "max_poll_delay", fallback=10800)
+        scheduler.update(
+            "weather refresh",
+            interval=config.getint("SCHEDULE", "weather_interval", fallback=900),
+        )
+        scheduler.update(
+            "solar data pull",
+            interval=config.getint("SCHEDULE", "poll_interval", fallback=3600),
+            offset=config.getint("SCHEDULE", "poll_offset", fallback=300),
+            jitter=config.getint("SCHEDULE", "jitter", fallback=60),
+        )
+
+    return reload
+
+
+if __name__ == "__main__":
+
+    config = configparser.ConfigParser()
+    config.read("config.ini")
+    setup_logging(config)
+
+    metrics_port = config.getint("METRICS", "collector_port", fallback=0)
+    if metrics_port:
+        serve(metrics_port, config.get("METRICS", "host", fallback="127.0.0.1"))
 
-            console.log("[bold][red]Done![/bold][/red]")
+    scheduler = Scheduler()
+    start(config, connect(config, MAX_MONGODB_DELAY), scheduler)
+    scheduler.run_forever()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""This script archives pruned solar history to compressed columnar files"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import os
+from collections import defaultdict
+from datetime import date, datetime
+import numpy as np
+from rich.console import Console
+
+console = Console()
+
+COLUMNS = ("epoch", "collected", "reporting", "status", "weather")
+
+
+def to_columns(docs):
+    """Convert documents to arrays sorted by report time"""
+    docs = sorted(docs, key=lambda doc: doc["EpochLastReport"])
+    return {
+        "epoch": np.array([doc["EpochLastReport"] for doc in docs], dtype=np.int64),
+        "collected": np.array(
+            [doc.get("Collected") or 0 for doc in docs], dtype=np.float64
+        ),
+        "reporting": np.array([bool(doc.get("Reporting")) for doc in docs]),
+        "status": np.array([str(doc.get("Status")) for doc in docs], dtype="U16"),
+        "weather": np.array([doc.get("WeatherId", -1) for doc in docs], dtype=np.int16),
+    }
+
+
+class Archive:
+    """Compressed NPZ files partitioned by system and local day
+
+    ``<root>/<system>/<YYYY-MM-DD>.npz`` holds one array per column, sorted
+    by report time. Writing to an existing partition merges and
+    de-duplicates on report time. Reads expand a partition once into
+    uncompressed ``.npy`` files under ``<root>/.cache`` and memory-map
+    those, so repeated range scans only touch the pages they need.
+
+    Args:
+        root (str): Archive directory
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def watermark(self):
+        """Newest report time known to be archived, 0 if none"""
+        try:
+            with open(os.path.join(self.root, "watermark"), encoding="utf-8") as mark:
+                return int(mark.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def set_watermark(self, epoch):
+        """Record the newest report time archived"""
+        path = os.path.join(self.root, "watermark")
+        with open(path + ".tmp", "w", encoding="utf-8") as mark:
+            mark.write(str(epoch))
+        os.replace(path + ".tmp", path)
+
+    def partition(self, system, day):
+        """Path of a system's archive file for a day"""
+        return os.path.join(self.root, str(system), f"{day.isoformat()}.npz")
+
+    def cache_dir(self, system, day):
+        """Directory holding the expanded columns of a partition"""
+        return os.path.join(self.root, ".cache", str(system), day.isoformat())
+
+    def write(self, docs):
+        """Append documents to their partitions
+
+        Returns:
+            int: Number of partitions written
+        """
+        partitions = defaultdict(list)
+        for doc in docs:
+            day = datetime.fromtimestamp(doc["EpochLastReport"]).date()
+            partitions[(doc.get("System"), day)].append(doc)
+
+        for (system, day), part in partitions.items():
+            path = self.partition(system, day)
+            columns = to_columns(part)
+            if os.path.exists(path):
+                with np.load(path) as existing:
+                    columns = {
+                        name: np.concatenate([existing[name], columns[name]])
+                        for name in COLUMNS
+                    }
+                _, keep = np.unique(columns["epoch"], return_index=True)
+                columns = {name: column[keep] for name, column in columns.items()}
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path[: -len(".npz")] + ".tmp.npz"
+            np.savez_compressed(tmp_path, **columns)
+            os.replace(tmp_path, path)
+            self.invalidate(system, day)
+
+        return len(partitions)
+
+    def invalidate(self, system, day):
+        """Drop the expanded copy of a partition after it changes"""
+        cache = self.cache_dir(system, day)
+        if os.path.isdir(cache):
+            for name in os.listdir(cache):
+                os.remove(os.path.join(cache, name))
+            os.rmdir(cache)
+
+    def load(self, system, day):
+        """Memory-map one partition's columns, expanding it on first use
+
+        Returns:
+            dict: Column name -> read-only memory-mapped array, or None
+        """
+        path = self.partition(system, day)
+        if not os.path.exists(path):
+            return None
+        cache = self.cache_dir(system, day)
+        if not os.path.isdir(cache):
+            os.makedirs(cache + ".tmp", exist_ok=True)
+            with np.load(path) as columns:
+                for name in COLUMNS:
+                    np.save(os.path.join(cache + ".tmp", name + ".npy"), columns[name])
+            os.replace(cache + ".tmp", cache)
+        return {
+            name: np.load(os.path.join(cache, name + ".npy"), mmap_mode="r")
+            for name in COLUMNS
+        }
+
+    def systems(self):
+        """Every archived system id"""
+        return sorted(
+            name
+            for name in os.listdir(self.root)
+            if not name.startswith(".") and os.path.isdir(os.path.join(self.root, name))
+        )
+
+    def scan(self, system, start, end):
+        """Yield column slices of a system's history in [start, end)
+
+        Args:
+            system (str): Enphase system id
+            start (int): Epoch, inclusive
+            end (int): Epoch, exclusive
+        """
+        first = datetime.fromtimestamp(start).date()
+        last = datetime.fromtimestamp(end).date()
+        for day in self.days(system):
+            if first <= day <= last:
+                columns = self.load(system, day)
+                lo, hi = np.searchsorted(columns["epoch"], [start, end])
+                if hi > lo:
+                    yield {name: column[lo:hi] for name, column in columns.items()}
+
+    def days(self, system):
+        """Archived days for a system, oldest first"""
+        folder = os.path.join(self.root, str(system))
+        if not os.path.isdir(folder):
+            return []
+        return sorted(
+            date.fromisoformat(name[: -len(".npz")])
+            for name in os.listdir(folder)
+            if name.endswith(".npz") and ".tmp" not in name
+        )
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""This script backfills per-interval production from the Enphase stats API"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import asyncio
+from datetime import datetime, timezone
+from time import time
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import PyMongoError
+from rich import box
+from rich.console import Console
+from rich.table import Table
+from utils.httpclient import async_session
+from utils.poller import KeyLimiter, fetch_json
+from utils.schema import ensure_index
+
+console = Console()
+
+STATS_URL = "https://api.enphaseenergy.com/api/v2/systems/{system}/stats"
+
+# The stats endpoint returns at most one day of 5 minute intervals per call
+MAX_SPAN = 86400
+
+
+def pages(start, end):
+    """Split [start, end) into windows the stats endpoint accepts"""
+    while start < end:
+        yield (start, min(start + MAX_SPAN, end))
+        start += MAX_SPAN
+
+
+def interval_record(system, interval):
+    """Shape one stats interval into a MongoDB document"""
+    return {
+        "System": system,
+        "EndAt": interval["end_at"],
+        "IntervalEnd": datetime.fromtimestamp(interval["end_at"], timezone.utc),
+        "Energy": interval.get("enwh", 0),
+        "Power": interval.get("powr", 0),
+        "DevicesReporting": interval.get("devices_reporting", 0),
+    }
+
+
+class Backfill:
+    """Fetch only the intervals newer than the last one stored, per system
+
+    A high-water mark per system, the ``end_at`` of the newest interval
+    stored, lives in ``<prefix>_backfill``. Each run asks the stats endpoint
+    for everything after it, one request per day missed, so a daily run
+    costs one request per system and a few days of downtime are caught up
+    in as many. Systems whose latest summary report is not newer than
+    their mark are skipped. Requests go out concurrently over the fleet
+    poller's pooled client. Intervals are upserted on (System, EndAt), so a
+    retried window never duplicates data, and expire after ``retention``
+    seconds like the raw samples.
+
+    Args:
+        db (Database): MongoDB database
+        prefix (str): Collections are ``<prefix>_intervals`` and
+            ``<prefix>_backfill``
+        max_age (int): Never reach back further than this many seconds
+        max_pages (int): Requests per system per run at most
+        retention (int): Seconds to keep intervals, 0 keeps them forever
+    """
+
+    def __init__(self, db, prefix, max_age=7 * 86400, max_pages=4, retention=0):
+        self.intervals = db[prefix + "_intervals"]
+        self.marks = db[prefix + "_backfill"]
+        self.max_age = max_age
+        self.max_pages = max_pages
+        ensure_index(
+            self.intervals,
+            [("System", ASCENDING), ("EndAt", ASCENDING)],
+            name="system_end",
+            unique=True,
+        )
+        if retention > 0:
+            ensure_index(
+                self.intervals,
+                [("IntervalEnd", ASCENDING)],
+                name="ttl_interval_end",
+                expireAfterSeconds=retention,
+            )
+
+    def watermarks(self, systems):
+        """Newest interval end stored per system, one query for all"""
+        return {
+            mark["_id"]: mark["end_at"]
+            for mark in self.marks.find({"_id": {"$in": list(systems)}})
+        }
+
+    def set_watermark(self, system, end_at):
+        """Advance a system's high-water mark, never moving it back"""
+        self.marks.update_one(
+            {"_id": system}, {"$max": {"end_at": end_at}}, upsert=True
+        )
+
+    def windows(self, mark, now):
+        """Windows after a mark to request this run"""
+        start = max(mark + 1, now - self.max_age)
+        return list(pages(start, now))[: self.max_pages]
+
+    async def fetch_site(self, session, site, windows, limiter, retries):
+        """Request a system's windows in order, stopping at the first failure
+
+        Returns:
+            tuple: (site, list of (window end, intervals or None))
+        """
+        results = []
+        for start_at, end_at in windows:
+            data = await fetch_json(
+                session,
+                site,
+                STATS_URL.format(system=site.system),
+                {
+                    "key": site.key,
+                    "user_id": site.user,
+                    "start_at": start_at,
+                    "end_at": end_at,
+                },
+                limiter,
+                retries,
+                "enphase_stats",
+            )
+            results.append(
+                (end_at, None if data is None else data.get("intervals", []))
+            )
+            if data is None:
+                break
+        return (site, results)
+
+    async def fetch_all(
+        self,
+        plans,
+        per_key=2,
+        max_connections=50,
+        per_host=None,
+        timeout=10,
+        retries=3,
+    ):
+        """Fetch every planned system concurrently, as a fleet sweep does"""
+        limiters = {}
+        for site, _ in plans:
+            limiters.setdefault(site.key, KeyLimiter(per_key))
+
+        async with async_session(max_connections, per_host, timeout) as session:
+            return await asyncio.gather(
+                *(
+                    self.fetch_site(session, site, windows, limiters[site.key], retries)
+                    for site, windows in plans
+                )
+            )
+
+    def store(self, site, results, now):
+        """Upsert fetched intervals and advance the system's mark
+
+        Returns:
+            int: Intervals stored
+        """
+        stored = 0
+        for end_at, intervals in results:
+            if intervals is None:
+                break
+            if intervals:
+                self.intervals.bulk_write(
+                    [
+                        UpdateOne(
+                            {"System": site.system, "EndAt": interval["end_at"]},
+                            {"$set": interval_record(site.system, interval)},
+                            upsert=True,
+                        )
+                        for interval in intervals
+                    ],
+                    ordered=False,
+                )
+                stored += len(intervals)
+                self.set_watermark(
+                    site.system, max(interval["end_at"] for interval in intervals)
+                )
+            elif end_at <= now - MAX_SPAN:
+                # Nothing produced and too old to still arrive, skip it next time
+                self.set_watermark(site.system, end_at)
+        return stored
+
+    def run(self, sites, latest=None, **poller_opts):
+        """Catch up every system that has something new and print a summary
+
+        Args:
+            sites (list): Site tuples
+            latest (dict): System id -> newest summary ``last_report_at``
+            poller_opts: per_key, max_connections, per_host, timeout and
+                retries, as for a fleet sweep
+
+        Returns:
+            int: Intervals stored
+        """
+        start = time()
+        now = int(start)
+        latest = latest or {}
+        requests = 0
+        stored = 0
+        limited = 0
+        skipped = 0
+
+        try:
+            marks = self.watermarks(site.system for site in sites)
+            plans = []
+            for site in sites:
+                mark = marks.get(site.system, 0)
+                if latest.get(site.system) is not None and latest[site.system] <= mark:
+                    skipped += 1
+                    continue
+                windows = self.windows(mark, now)
+                if windows:
+                    plans.append((site, windows))
+
+            fetched = asyncio.run(self.fetch_all(plans, **poller_opts)) if plans else []
+
+            for site, results in fetched:
+                requests += len(results)
+                limited += len(results) >= self.max_pages
+                stored += self.store(site, results, now)
+        except PyMongoError as error:
+            console.log(f"[red]--- Backfill stopped: {error} ---[/]")
+
+        backfill_table = Table(
+            title="Backfill Statistics", box=box.SIMPLE, style="cyan"
+        )
+
+        backfill_table.add_column("Type", style="cyan3")
+        backfill_table.add_column("Data", justify="right", style="cyan3")
+
+        backfill_table.add_row("Systems", str(len(sites)))
+        backfill_table.add_row("Systems up to date", str(skipped))
+        backfill_table.add_row("Requests", str(requests))
+        backfill_table.add_row("Intervals stored", str(stored))
+        backfill_table.add_row("Systems at page limit", str(limited))
+        backfill_table.add_row("Seconds", f"{(time() - start):.3f}")
+
+        console.print(backfill_table)
+
+        return stored
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""This script fans system status out from the collector over UDP multicast"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import json
+import socket
+import struct
+import threading
+from datetime import datetime, timezone
+from time import time
+from rich.console import Console
+
+console = Console()
+
+# Administratively scoped group, never routed off the site
+GROUP = "239.255.42.99"
+PORT = 5007
+
+# Stay under the smallest common MTU so a datagram is never fragmented
+MAX_DATAGRAM = 1200
+
+# Sent on the wire; LastReport is rebuilt from EpochLastReport on arrival
+FIELDS = ("System", "EpochLastReport", "Collected", "Status", "Reporting")
+
+
+def encode(doc, updated):
+    """Compact JSON for one system's status"""
+    status = {field: doc[field] for field in FIELDS}
+    status["Updated"] = round(updated, 3)
+    return json.dumps(status, separators=(",", ":"))
+
+
+def datagrams(lines):
+    """Pack encoded statuses into as few datagrams as fit MAX_DATAGRAM"""
+    batch = []
+    size = 2
+    for line in lines:
+        if batch and size + len(line) + 1 > MAX_DATAGRAM:
+            yield ("[" + ",".join(batch) + "]").encode()
+            batch = []
+            size = 2
+        batch.append(line)
+        size += len(line) + 1
+    if batch:
+        yield ("[" + ",".join(batch) + "]").encode()
+
+
+def decode(datagram):
+    """Statuses in a datagram, shaped like StatusBoard documents"""
+    docs = json.loads(datagram)
+    for doc in docs:
+        doc["LastReport"] = datetime.fromtimestamp(
+            int(doc["EpochLastReport"]), timezone.utc
+        )
+        doc["Updated"] = datetime.fromtimestamp(doc["Updated"], timezone.utc)
+    return docs
+
+
+class StatusPublisher:
+    """Send each status update to every LED controller on the network
+
+    UDP is fire and forget, so once started a background thread resends
+    the last status of every system it knows every ``heartbeat`` seconds,
+    however long the collector waits between polls. A controller that
+    missed a datagram or started late is current again within one
+    heartbeat, and keeps hearing the collector at night, without ever
+    opening a MongoDB connection.
+
+    Args:
+        group (str): Multicast group address
+        port (int): UDP port
+        ttl (int): Router hops a datagram may cross, 1 keeps it on the LAN
+        heartbeat (int): Seconds between full resends
+        interface (str): Local address to send from, 0.0.0.0 for the default
+    """
+
+    def __init__(
+        self, group=GROUP, port=PORT, ttl=1, heartbeat=300, interface="0.0.0.0"
+    ):
+        self.address = (group, port)
+        self.heartbeat = heartbeat
+        self.last = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.sock.setsockopt(
+            socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface)
+        )
+
+    def publish(self, docs):
+        """Send the status of every system in a batch of samples
+
+        Returns:
+            bool: False if a datagram could not be sent
+        """
+        updated = time()
+        with self.lock:
+            lines = []
+            for doc in docs:
+                line = self.last[doc["System"]] = encode(doc, updated)
+                lines.append(line)
+        return self.send(lines)
+
+    def send(self, lines):
+        """Multicast encoded statuses
+
+        Returns:
+            bool: False if a datagram could not be sent
+        """
+        try:
+            for datagram in datagrams(lines):
+                self.sock.sendto(datagram, self.address)
+        except OSError as error:
+            console.log(f"[red]--- Status not multicast: {error} ---[/]")
+            return False
+        return True
+
+    def resend(self):
+        """Repeat every known status until stop() is called"""
+        while not self.stopped.wait(self.heartbeat):
+            with self.lock:
+                lines = list(self.last.values())
+            if lines:
+                self.send(lines)
+
+    def start(self):
+        """Start the heartbeat thread"""
+        threading.Thread(
+            target=self.resend, name="status heartbeat", daemon=True
+        ).start()
+
+    def stop(self):
+        """Stop the heartbeat and close the socket"""
+        self.stopped.set()
+        self.sock.close()
+
+
+class StatusListener:
+    """Follow status multicast by the collector, like a RecordWatcher
+
+    ``latest`` holds the newest status heard for ``system``, or for any
+    system when none is given, and the callback runs only when a new
+    report arrives, not for heartbeat repeats. ``active`` is True while
+    the collector has been heard from within ``stale`` seconds, so the
+    caller can fall back to reading MongoDB.
+
+    Args:
+        callback (callable): Called with each new status document
+        group (str): Multicast group address
+        port (int): UDP port
+        system (str): Only follow this system id
+        stale (int): Seconds of silence before ``active`` turns False
+        interface (str): Local address to join on, 0.0.0.0 for the default
+    """
+
+    source = "multicast"
+
+    def __init__(
+        self,
+        callback,
+        group=GROUP,
+        port=PORT,
+        system=None,
+        stale=900,
+        interface="0.0.0.0",
+    ):
+        self.callback = callback
+        self.group = group
+        self.port = port
+        self.system = system
+        self.stale = stale
+        self.interface = interface
+        self.latest = None
+        self.heard = 0
+        self.stopped = threading.Event()
+
+    @property
+    def active(self):
+        """True while the collector is being heard"""
+        return time() - self.heard < self.stale
+
+    def open(self):
+        """Bind the port and join the group"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("", self.port))
+        membership = struct.pack(
+            "4s4s", socket.inet_aton(self.group), socket.inet_aton(self.interface)
+        )
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        sock.settimeout(1)
+        return sock
+
+    def receive(self, datagram):
+        """Take in one datagram, calling back for a newer report"""
+        try:
+            docs = decode(datagram)
+        except (ValueError, KeyError, TypeError) as error:
+            console.log(f"[bright_yellow]--- Bad status datagram: {error} ---[/]")
+            return
+        self.heard = time()
+        for doc in docs:
+            if self.system is not None and doc["System"] != self.system:
+                continue
+            if (
+                self.latest is None
+                or doc["EpochLastReport"] > self.latest["EpochLastReport"]
+            ):
+                self.latest = doc
+                self.callback(doc)
+
+    def run(self):
+        """Read datagrams until stop() is called"""
+        try:
+            sock = self.open()
+        except OSError as error:
+            console.log(f"[red]--- Status multicast unavailable: {error} ---[/]")
+            return
+        console.log(
+            f"[green]--- Listening for status on {self.group}:{self.port} ---[/]"
+        )
+        with sock:
+            while not self.stopped.is_set():
+                try:
+                    datagram = sock.recv(65535)
+                except socket.timeout:
+                    continue
+                self.receive(datagram)
+
+    def start(self):
+        """Listen on a background thread"""
+        threading.Thread(target=self.run, name="status listener", daemon=True).start()
+
+    def stop(self):
+        """Stop listening"""
+        self.stopped.set()
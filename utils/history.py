@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""This script keeps the last few samples of every system in memory"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import sys
+from array import array
+from collections import namedtuple
+
+Sample = namedtuple("Sample", ["polled", "epoch", "collected", "reporting", "status"])
+
+# Status strings are stored as a one byte index into this list; unknown
+# statuses are appended as they are first seen
+STATUSES = ["normal", "comm", "power", "meter", "micro"]
+
+
+def status_code(status):
+    """One byte index of a status string"""
+    try:
+        return STATUSES.index(status)
+    except ValueError:
+        STATUSES.append(status)
+        return len(STATUSES) - 1
+
+
+class Ring:
+    """Fixed size ring of samples for one system, column by column
+
+    Each column is a typed array, so a sample costs 21 bytes rather than a
+    few hundred for a dict, and the footprint never grows past
+    ``capacity`` samples.
+
+    Args:
+        capacity (int): Samples kept, oldest dropped first
+    """
+
+    __slots__ = ("polled", "epochs", "collected", "flags", "head", "count")
+
+    def __init__(self, capacity):
+        self.polled = array("q", [0]) * capacity
+        self.epochs = array("q", [0]) * capacity
+        self.collected = array("i", [0]) * capacity
+        # Bit 0 is Reporting, the rest is the status index
+        self.flags = array("B", [0]) * capacity
+        self.head = 0
+        self.count = 0
+
+    def append(self, polled, epoch, collected, reporting, status):
+        """Overwrite the oldest sample"""
+        head = self.head
+        self.polled[head] = polled
+        self.epochs[head] = epoch
+        self.collected[head] = collected
+        self.flags[head] = status_code(status) << 1 | bool(reporting)
+        self.head = (head + 1) % len(self.epochs)
+        self.count = min(self.count + 1, len(self.epochs))
+
+    def index(self, age):
+        """Array index of the sample ``age`` places back, 0 being the newest"""
+        return (self.head - 1 - age) % len(self.epochs)
+
+    def sample(self, age=0):
+        """Sample ``age`` places back, 0 being the newest"""
+        i = self.index(age)
+        return Sample(
+            self.polled[i],
+            self.epochs[i],
+            self.collected[i],
+            bool(self.flags[i] & 1),
+            STATUSES[self.flags[i] >> 1],
+        )
+
+
+class History:
+    """Recent samples of every system, bounded in memory
+
+    The collector adds each poll and can then answer trend, lag and anomaly
+    questions from memory instead of a database round trip. A poll that
+    sees the same report again is not stored, so the lag of a sample is
+    from the report to the first poll that saw it. Energy resets each day,
+    so trends only look back to the last drop in ``Collected``.
+
+    Args:
+        capacity (int): Samples kept per system
+    """
+
+    def __init__(self, capacity=96):
+        self.capacity = capacity
+        self.rings = {}
+
+    def add(self, system, polled, epoch, collected, reporting, status):
+        """Store one sample, unless it repeats the newest report"""
+        ring = self.rings.get(system)
+        if ring is None:
+            ring = self.rings[system] = Ring(self.capacity)
+        elif ring.count and ring.epochs[ring.index(0)] == epoch:
+            return
+        ring.append(polled, epoch, collected, reporting, status)
+
+    def extend(self, docs, polled):
+        """Store a batch of solar records"""
+        for doc in docs:
+            self.add(
+                doc["System"],
+                polled,
+                doc["EpochLastReport"],
+                doc["Collected"],
+                doc["Reporting"],
+                doc["Status"],
+            )
+
+    def samples(self, system):
+        """Samples of a system, oldest first"""
+        ring = self.rings.get(system)
+        if ring is None:
+            return []
+        return [ring.sample(age) for age in range(ring.count - 1, -1, -1)]
+
+    def latest(self, system):
+        """Newest sample of a system, None if never seen"""
+        ring = self.rings.get(system)
+        return ring.sample() if ring is not None and ring.count else None
+
+    def lag(self, system):
+        """Seconds between the last report and the poll that saw it"""
+        ring = self.rings.get(system)
+        if ring is None or not ring.count:
+            return None
+        i = ring.index(0)
+        return ring.polled[i] - ring.epochs[i]
+
+    def lag_percentile(self, system, fraction):
+        """Report lag at a percentile over the kept samples"""
+        ring = self.rings.get(system)
+        if ring is None or not ring.count:
+            return None
+        lags = sorted(
+            ring.polled[ring.index(age)] - ring.epochs[ring.index(age)]
+            for age in range(ring.count)
+        )
+        return lags[min(len(lags) - 1, int(fraction * len(lags)))]
+
+    def trend(self, system, window=None):
+        """Production rate since the start of the day, or over ``window`` samples
+
+        Returns:
+            float: Wh per hour, None with fewer than two distinct reports
+        """
+        ring = self.rings.get(system)
+        if ring is None or ring.count < 2:
+            return None
+        newest = ring.index(0)
+        oldest = newest
+        limit = ring.count if window is None else min(window, ring.count)
+        for age in range(1, limit):
+            i = ring.index(age)
+            if ring.collected[i] > ring.collected[oldest]:
+                break
+            oldest = i
+        seconds = ring.epochs[newest] - ring.epochs[oldest]
+        if seconds <= 0:
+            return None
+        return (ring.collected[newest] - ring.collected[oldest]) * 3600 / seconds
+
+    def anomalies(self, system, now, stale=86400, flat=4):
+        """What looks wrong with a system from its recent samples
+
+        Returns:
+            list: Any of "not reporting", "comm", "stale" and "flat", the last
+            when ``flat`` new reports in a row added no energy
+        """
+        ring = self.rings.get(system)
+        if ring is None or not ring.count:
+            return []
+        reasons = []
+        newest = ring.index(0)
+        if not ring.flags[newest] & 1:
+            reasons.append("not reporting")
+        if STATUSES[ring.flags[newest] >> 1] == "comm":
+            reasons.append("comm")
+        if now - ring.epochs[newest] > stale:
+            reasons.append("stale")
+        if ring.count > flat and all(
+            ring.collected[ring.index(age)] == ring.collected[newest]
+            for age in range(1, flat + 1)
+        ):
+            reasons.append("flat")
+        return reasons
+
+    def flagged(self, now, stale=86400, flat=4):
+        """Every system with an anomaly
+
+        Returns:
+            dict: System id -> reasons
+        """
+        flagged = {}
+        for system in self.rings:
+            reasons = self.anomalies(system, now, stale, flat)
+            if reasons:
+                flagged[system] = reasons
+        return flagged
+
+    def footprint(self):
+        """Approximate bytes held by the store"""
+        size = sys.getsizeof(self.rings)
+        for system, ring in self.rings.items():
+            size += sys.getsizeof(system) + sys.getsizeof(ring)
+            for column in (ring.polled, ring.epochs, ring.collected, ring.flags):
+                size += sys.getsizeof(column)
+        return size
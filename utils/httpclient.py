@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""This script provides the pooled HTTP clients shared by every API caller"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import threading
+from time import perf_counter
+import requests
+from requests.adapters import HTTPAdapter, Retry
+from rich import box
+from rich.console import Console
+from rich.table import Table
+from utils.metrics import HTTP_SECONDS
+
+console = Console()
+
+# (connect, read) seconds for every blocking request
+TIMEOUT = (3.05, 10)
+
+# Per-host pool sizes and retry policies. Enphase answers 409 when the
+# per-minute quota is spent, so it is retried like a 429.
+HOSTS = {
+    "https://api.enphaseenergy.com/": {
+        "pool": 10,
+        "status_forcelist": [409, 429, 500, 502, 503, 504],
+    },
+    "http://api.openweathermap.org/": {
+        "pool": 4,
+        "status_forcelist": [429, 500, 502, 503, 504],
+    },
+}
+
+# Seconds in an Enphase quota period; a spent quota is back after at most this
+QUOTA_WINDOW = 60
+
+SESSION = {"session": None}
+SESSION_LOCK = threading.Lock()
+
+
+class QuotaRetry(Retry):
+    """Retry that waits out a spent rate limit quota
+
+    A 409 or 429 without a Retry-After header means the quota for the
+    current period is spent, and backing off a second or two only burns
+    the retry inside the same period. Wait a whole quota window instead.
+    """
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None and response.status in (409, 429):
+            return QUOTA_WINDOW
+        return retry_after
+
+
+def retry_policy(status_forcelist):
+    """Retry GETs three times with exponential backoff"""
+    return QuotaRetry(
+        total=3,
+        backoff_factor=1,
+        status_forcelist=status_forcelist,
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def get_session():
+    """Return the process-wide keep-alive session, creating it on first use"""
+    with SESSION_LOCK:
+        if SESSION["session"] is None:
+            http = requests.Session()
+            default = HTTPAdapter(max_retries=retry_policy([429, 500, 502, 503, 504]))
+            http.mount("http://", default)
+            http.mount("https://", default)
+            for prefix, host in HOSTS.items():
+                http.mount(
+                    prefix,
+                    HTTPAdapter(
+                        pool_connections=1,
+                        pool_maxsize=host["pool"],
+                        max_retries=retry_policy(host["status_forcelist"]),
+                    ),
+                )
+            SESSION["session"] = http
+        return SESSION["session"]
+
+
+def record(endpoint, seconds):
+    """Store one request latency for an endpoint"""
+    HTTP_SECONDS.observe(seconds, endpoint=endpoint)
+
+
+def get(url, endpoint, **kwargs):
+    """GET through the shared session, recording latency under ``endpoint``
+
+    Args:
+        url (str): Request URL
+        endpoint (str): Name latency is recorded under, e.g. "weather"
+
+    Returns:
+        Response: requests response
+    """
+    kwargs.setdefault("timeout", TIMEOUT)
+    start = perf_counter()
+    try:
+        return get_session().get(url, **kwargs)
+    finally:
+        record(endpoint, perf_counter() - start)
+
+
+def async_session(max_connections=50, per_host=None, timeout=10):
+    """Create a pooled aiohttp session with the same limits and timeouts
+
+    Must be called from inside a running event loop. aiohttp is imported
+    here because only fleet sweeps need it and it is the slowest import in
+    the collector. Every fleet request goes to the one Enphase host, so
+    ``per_host`` defaults to the whole pool.
+    """
+    import aiohttp  # pylint: disable=import-outside-toplevel
+
+    if per_host is None:
+        per_host = max_connections
+    connector = aiohttp.TCPConnector(limit=max_connections, limit_per_host=per_host)
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout, connect=TIMEOUT[0]),
+    )
+
+
+def latency_stats():
+    """Summarize recorded latency per endpoint
+
+    Returns:
+        dict: endpoint -> count, p50, p95 and max in seconds
+    """
+    stats = {}
+    for key, series in HTTP_SECONDS.snapshot().items():
+        labels = dict(key)
+        stats[labels["endpoint"]] = {
+            "count": series["count"],
+            "p50": HTTP_SECONDS.quantile(0.50, **labels),
+            "p95": HTTP_SECONDS.quantile(0.95, **labels),
+            "max": series["max"],
+        }
+    return stats
+
+
+def log_latency():
+    """Print recorded latency per endpoint"""
+    latency_table = Table(title="HTTP Latency", box=box.SIMPLE, style="cyan")
+
+    latency_table.add_column("Endpoint", style="cyan3")
+    latency_table.add_column("Count", justify="right", style="cyan3")
+    latency_table.add_column("p50", justify="right", style="cyan3")
+    latency_table.add_column("p95", justify="right", style="cyan3")
+    latency_table.add_column("Max", justify="right", style="cyan3")
+
+    for endpoint, stats in latency_stats().items():
+        latency_table.add_row(
+            endpoint,
+            str(stats["count"]),
+            f"{stats['p50']:.3f}",
+            f"{stats['p95']:.3f}",
+            f"{stats['max']:.3f}",
+        )
+
+    console.print(latency_table)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""This script drives the status LEDs on real or simulated GPIO"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+from rich.console import Console
+
+console = Console()
+
+
+class SimulatedBackend:
+    """In-memory GPIO for running and benchmarking off a Raspberry Pi"""
+
+    def __init__(self, pins, names=None):
+        self.names = names or {}
+        self.levels = dict.fromkeys(pins, False)
+        self.writes = 0
+
+    def write(self, pins, levels):
+        """Set several pins in one call"""
+        self.writes += 1
+        self.levels.update(zip(pins, levels))
+        changes = ", ".join(
+            f"{self.names.get(pin, pin)} {'on' if level else 'off'}"
+            for pin, level in zip(pins, levels)
+        )
+        console.log(f"[dim]--- Simulated LEDs: {changes} ---[/dim]")
+
+    def close(self):
+        """Nothing to release"""
+
+
+class GpioBackend:
+    """RPi.GPIO output pins, imported only when this backend is used"""
+
+    def __init__(self, pins, names=None):
+        from RPi import GPIO  # pylint: disable=import-outside-toplevel
+
+        self.gpio = GPIO
+        self.names = names or {}
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        GPIO.setup(list(pins), GPIO.OUT, initial=GPIO.LOW)
+
+    def write(self, pins, levels):
+        """Set several pins in one GPIO.output call"""
+        self.gpio.output(
+            list(pins), [self.gpio.HIGH if level else self.gpio.LOW for level in levels]
+        )
+
+    def close(self):
+        """Release the pins"""
+        self.gpio.cleanup()
+
+
+class LedDriver:
+    """Stage LED changes and write only the pins that differ
+
+    Callers stage the state they want with ``stage``/``stage_all`` and then
+    ``commit``, which sends every changed pin to the backend in one write.
+    Turning everything off and back on within one update therefore never
+    reaches the hardware, so LEDs do not flicker between updates.
+
+    Args:
+        backend: SimulatedBackend or GpioBackend
+        pins (iterable): Output pin numbers
+    """
+
+    def __init__(self, backend, pins):
+        self.backend = backend
+        self.current = dict.fromkeys(pins, False)
+        self.desired = dict(self.current)
+
+    def stage(self, pin, on):
+        """Set the level a pin should have after the next commit"""
+        self.desired[pin] = bool(on)
+
+    def stage_all(self, on=False):
+        """Set every pin to the same level after the next commit"""
+        for pin in self.desired:
+            self.desired[pin] = bool(on)
+
+    def commit(self):
+        """Write the staged changes
+
+        Returns:
+            int: Number of pins written
+        """
+        changed = [pin for pin, on in self.desired.items() if self.current[pin] != on]
+        if changed:
+            self.backend.write(changed, [self.desired[pin] for pin in changed])
+            for pin in changed:
+                self.current[pin] = self.desired[pin]
+        return len(changed)
+
+    def set(self, pin, on):
+        """Stage and commit one pin"""
+        self.stage(pin, on)
+        return self.commit()
+
+    def close(self):
+        """Turn everything off and release the backend"""
+        self.stage_all(False)
+        self.commit()
+        self.backend.close()
+
+
+def create_driver(pins, backend="auto"):
+    """Build an LED driver on real GPIO when available
+
+    Args:
+        pins (dict): LED name -> BCM pin number
+        backend (str): "rpi", "simulated", or "auto" to try RPi.GPIO first
+
+    Returns:
+        LedDriver: Driver over the chosen backend
+    """
+    names = {pin: name for name, pin in pins.items()}
+    if backend in ("auto", "rpi"):
+        try:
+            return LedDriver(GpioBackend(names, names), names)
+        except (ImportError, RuntimeError) as error:
+            if backend == "rpi":
+                raise
+            console.log(f"[bright_yellow]--- GPIO unavailable, simulating: {error}[/]")
+    return LedDriver(SimulatedBackend(names, names), names)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""This script sets up Rich output on a terminal and JSON lines everywhere else"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from rich.console import Console
+from rich.logging import RichHandler
+from rich.table import Table
+from rich.text import Text
+
+# Repository root; modules loaded from below it have their consoles swapped
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATE = {"headless": False}
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One compact JSON object per record"""
+
+    def format(self, record):
+        line = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in RESERVED:
+                line[name] = value
+        if record.exc_info:
+            line["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            line["exc"] = record.exc_text
+        return json.dumps(line, default=str, separators=(",", ":"))
+
+
+class RecordQueueHandler(QueueHandler):
+    """Queue records with the message and traceback rendered, nothing more
+
+    The stock handler formats the whole line on the caller's thread and
+    folds the traceback into the message; here JSON encoding is left to
+    the listener thread and the traceback stays in its own field.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def plain(markup):
+    """Drop Rich markup and the ``--- ... ---`` decoration from a message"""
+    return Text.from_markup(str(markup)).plain.strip(" -")
+
+
+def table_data(table):
+    """Flatten a Rich table into JSON-ready fields
+
+    The repo's two column "Type"/"Data" tables become a mapping, anything
+    wider becomes a list of rows keyed by header.
+    """
+    headers = [str(column.header) for column in table.columns]
+    rows = zip(*(list(column.cells) for column in table.columns))
+    if headers == ["Type", "Data"]:
+        return {"data": {str(name): str(value) for name, value in rows}}
+    return {"rows": [dict(zip(headers, map(str, row))) for row in rows]}
+
+
+class HeadlessConsole:
+    """Stand-in for a module's Rich console that logs instead of rendering
+
+    ``console.log`` becomes an INFO record with the markup stripped and
+    ``console.print`` of a table becomes one record carrying its rows, so
+    no table is ever laid out.
+
+    Args:
+        logger (Logger): Logger records go to
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.quiet = False
+
+    def log(self, *objects, **_):
+        """Log a message"""
+        if not self.quiet:
+            self.logger.info(" ".join(plain(obj) for obj in objects))
+
+    def print(self, *objects, **_):
+        """Log a table as structured data, anything else as a message"""
+        if self.quiet:
+            return
+        for obj in objects:
+            if isinstance(obj, Table):
+                self.logger.info(plain(obj.title or "table"), extra=table_data(obj))
+            else:
+                self.logger.info(plain(obj))
+
+    def print_exception(self, **_):
+        """Log the exception being handled"""
+        self.logger.error("Unhandled exception", exc_info=True)
+
+
+def headless(mode="auto"):
+    """True when output should be JSON lines rather than Rich"""
+    if mode == "auto":
+        return not sys.stdout.isatty()
+    return mode == "json"
+
+
+def setup_logging(config=None, mode=None):
+    """Configure the root logger once for the whole process
+
+    On a terminal, records go through a RichHandler. Headless, they are
+    put on a queue by a QueueHandler and a background QueueListener writes
+    them to stdout as JSON lines, so callers never block on the stream,
+    and the Rich console of every module loaded so far is swapped for a
+    HeadlessConsole; see headless_consoles().
+
+    Args:
+        config (ConfigParser): Reads [LOGGING] mode and level when given
+        mode (str): "auto", "rich" or "json", overrides the config
+
+    Returns:
+        bool: True when running headless
+    """
+    level = "INFO"
+    if config is not None:
+        mode = mode or config.get("LOGGING", "mode", fallback="auto")
+        level = config.get("LOGGING", "level", fallback=level).upper()
+    is_headless = headless(mode or "auto")
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level)
+
+    STATE["headless"] = is_headless
+    if not is_headless:
+        root.addHandler(RichHandler(rich_tracebacks=True, log_time_format="[%X]"))
+        return False
+
+    records = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    listener = QueueListener(records, stream)
+    listener.start()
+    atexit.register(listener.stop)
+    root.addHandler(RecordQueueHandler(records))
+
+    headless_consoles()
+    return True
+
+
+def headless_consoles():
+    """Swap the Rich console of every repo module loaded so far, if headless
+
+    Call again after importing modules lazily.
+    """
+    if not STATE["headless"]:
+        return
+    for name, module in list(sys.modules.items()):
+        path = os.path.abspath(getattr(module, "__file__", None) or "/")
+        if name == "__main__" or path.startswith(ROOT + os.sep):
+            if isinstance(getattr(module, "console", None), Console):
+                module.console = HeadlessConsole(logging.getLogger(name))
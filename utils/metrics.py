@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""This script records hot-path timings and serves them in Prometheus format"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from rich.console import Console
+
+console = Console()
+
+# Upper bounds of the latency buckets, in seconds
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Upper bounds of the batch size buckets, in documents
+DOCS = (1, 10, 50, 100, 250, 500, 1000, 5000, 10000)
+
+REGISTRY = {}
+REGISTRY_LOCK = threading.Lock()
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def label_text(labels, extra=None):
+    """Render a label set as ``{name="value",...}``"""
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    """Cumulative bucket counts, sum, count and max per label set
+
+    Observing walks a dozen bounds under a lock, cheap enough for every
+    request and every bulk write.
+
+    Args:
+        name (str): Metric name
+        help_text (str): One line description
+        buckets (tuple): Ascending upper bounds
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=SECONDS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Record one value"""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {
+                    "buckets": [0] * len(self.buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                    "max": value,
+                }
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][index] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+            series["max"] = max(series["max"], value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in a ``with`` block, even if it raises"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def quantile(self, fraction, **labels):
+        """Estimate a quantile by interpolating inside its bucket
+
+        Returns:
+            float: Estimate, capped at the largest value seen, or None
+        """
+        with self.lock:
+            series = self.series.get(tuple(sorted(labels.items())))
+            if series is None or not series["count"]:
+                return None
+            rank = fraction * series["count"]
+            seen = 0
+            lower = 0.0
+            for bound, count in zip(self.buckets, series["buckets"]):
+                if count and seen + count >= rank:
+                    estimate = lower + (bound - lower) * (rank - seen) / count
+                    return min(estimate, series["max"])
+                seen += count
+                lower = bound
+            return series["max"]
+
+    def snapshot(self):
+        """Copy of every series, keyed by label tuple"""
+        with self.lock:
+            return {
+                key: dict(series, buckets=list(series["buckets"]))
+                for key, series in self.series.items()
+            }
+
+    def render(self):
+        """Prometheus text lines"""
+        lines = []
+        for key, series in self.snapshot().items():
+            total = 0
+            for bound, count in zip(self.buckets, series["buckets"]):
+                total += count
+                lines.append(
+                    f"{self.name}_bucket{label_text(key, ('le', bound))} {total}"
+                )
+            lines.append(
+                f"{self.name}_bucket{label_text(key, ('le', '+Inf'))} "
+                f"{series['count']}"
+            )
+            lines.append(f"{self.name}_sum{label_text(key)} {series['sum']}")
+            lines.append(f"{self.name}_count{label_text(key)} {series['count']}")
+        return lines
+
+
+class Gauge:
+    """Current value per label set, set directly or read from a callback
+
+    Callbacks are only called when the metrics are scraped, so queues can
+    expose their depth without touching the hot path.
+
+    Args:
+        name (str): Metric name
+        help_text (str): One line description
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def set(self, value, **labels):
+        """Set the value"""
+        with self.lock:
+            self.series[tuple(sorted(labels.items()))] = value
+
+    def set_function(self, func, **labels):
+        """Read the value from ``func()`` at scrape time"""
+        self.set(func, **labels)
+
+    def render(self):
+        """Prometheus text lines"""
+        with self.lock:
+            series = list(self.series.items())
+        lines = []
+        for key, value in series:
+            if callable(value):
+                try:
+                    value = value()
+                except Exception:  # pylint: disable=broad-except
+                    continue
+            lines.append(f"{self.name}{label_text(key)} {float(value)}")
+        return lines
+
+
+def register(metric):
+    """Add a metric to the registry, returning the one already there if any"""
+    with REGISTRY_LOCK:
+        return REGISTRY.setdefault(metric.name, metric)
+
+
+def histogram(name, help_text, buckets=SECONDS):
+    """Get or create a histogram"""
+    return register(Histogram(name, help_text, buckets))
+
+
+def gauge(name, help_text):
+    """Get or create a gauge"""
+    return register(Gauge(name, help_text))
+
+
+HTTP_SECONDS = histogram(
+    "enlighten_http_request_seconds", "HTTP request latency by endpoint"
+)
+MONGO_SECONDS = histogram(
+    "enlighten_mongo_op_seconds", "MongoDB operation latency by operation"
+)
+BATCH_DOCS = histogram(
+    "enlighten_batch_docs", "Documents per bulk write or spool append", DOCS
+)
+QUEUE_DEPTH = gauge("enlighten_queue_depth", "Items waiting in each queue")
+PRUNE_SECONDS = histogram("enlighten_prune_seconds", "Duration of a retention pass")
+LED_LAG_SECONDS = histogram(
+    "enlighten_led_lag_seconds",
+    "Seconds from a record landing in MongoDB to the LEDs showing it",
+    (1, 5, 15, 30, 60, 300, 900, 1800, 3600, 7200),
+)
+
+
+def render():
+    """Every registered metric in the Prometheus text format"""
+    with REGISTRY_LOCK:
+        metrics = sorted(REGISTRY.values(), key=lambda metric: metric.name)
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve ``/metrics``"""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Render the registry"""
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Scrapes are not worth a console line"""
+
+
+def serve(port, host="127.0.0.1"):
+    """Serve the metrics endpoint from a background thread
+
+    Args:
+        port (int): TCP port, 0 picks a free one
+        host (str): Interface to bind, loopback by default
+
+    Returns:
+        ThreadingHTTPServer: The running server
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    console.log(
+        f"[green]--- Metrics on http://{host}:{server.server_address[1]}/metrics ---[/]"
+    )
+    return server
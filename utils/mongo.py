@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""This script builds the MongoDB client shared by every role in a process"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import threading
+import certifi
+from pymongo import MongoClient
+
+CLIENTS = {}
+CLIENTS_LOCK = threading.Lock()
+
+
+def mongo_uri(config):
+    """Atlas connection string from the [MONGO] section"""
+    return (
+        "mongodb+srv://"
+        + config["MONGO"]["user_name"]
+        + ":"
+        + config["MONGO"]["password"]
+        + "@"
+        + config["MONGO"]["mongo_addr"]
+        + "/"
+        + config["MONGO"]["mongo_db"]
+        + "?retryWrites=true&w=majority"
+    )
+
+
+def connect(config, timeout_ms=30000, lazy=False):
+    """Return the process-wide MongoClient for config.ini, creating it once
+
+    Every role in the process shares one client and its connection pool.
+    ``timeout_ms`` only applies when the client is created, so a role that
+    can wait longer retries on its own. A ``lazy`` client does not connect
+    in the background until its first operation.
+
+    Args:
+        config (ConfigParser): Parsed config.ini
+        timeout_ms (int): Server selection timeout for a new client
+        lazy (bool): Defer connecting a new client until it is used
+
+    Returns:
+        MongoClient: Shared client
+    """
+    uri = mongo_uri(config)
+    with CLIENTS_LOCK:
+        if uri not in CLIENTS:
+            CLIENTS[uri] = MongoClient(
+                uri,
+                tlsCAFile=certifi.where(),
+                serverSelectionTimeoutMS=timeout_ms,
+                connect=not lazy,
+            )
+        return CLIENTS[uri]
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""This script decides when the next Enphase poll should run"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+from collections import deque
+from statistics import median
+from time import time
+from rich.console import Console
+from utils.weather import DAY, sun_times
+
+console = Console()
+
+
+class PollPolicy:
+    """Schedule polls for when Enphase should have new data
+
+    Each poll records the ``last_report_at`` of every system. The median gap
+    between distinct reports is the system's reporting cadence, so the next
+    report is expected at the latest report plus that cadence. Polls are
+    skipped between cached sunset and sunrise, and back off exponentially
+    while reports are overdue. A fleet is swept at the median expected
+    report, and never more often than ``default``.
+
+    Args:
+        zip_code (str): Location used for the cached sunrise/sunset
+        units (str): Units the weather cache is keyed by
+        default (int): Cadence assumed until reports have been observed
+        min_delay (int): Never poll more often than this
+        max_delay (int): Never wait longer than this in daylight
+        margin (int): Seconds after an expected report before polling
+        history (int): Report gaps kept per system
+    """
+
+    def __init__(
+        self,
+        zip_code,
+        units,
+        default=3600,
+        min_delay=300,
+        max_delay=10800,
+        margin=120,
+        history=8,
+    ):
+        self.zip_code = zip_code
+        self.units = units
+        self.default = default
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.margin = margin
+        self.history = history
+        self.reports = {}
+        self.misses = 0
+
+    def observe(self, system, last_report_at):
+        """Record the latest report epoch seen for a system
+
+        Returns:
+            bool: True if this is a new report
+        """
+        reports = self.reports.setdefault(system, deque(maxlen=self.history + 1))
+        if reports and reports[-1] >= last_report_at:
+            return False
+        reports.append(last_report_at)
+        return True
+
+    def cadence(self, system):
+        """Median seconds between reports for a system"""
+        reports = self.reports.get(system)
+        if not reports or len(reports) < 2:
+            return self.default
+        gaps = [later - earlier for earlier, later in zip(reports, list(reports)[1:])]
+        return median(gaps)
+
+    def expected(self, system):
+        """Epoch at which the next report from a system should exist"""
+        reports = self.reports.get(system)
+        if not reports:
+            return None
+        return reports[-1] + self.cadence(system) + self.margin
+
+    def next_delay(self, fresh=True, now=None):
+        """Seconds until the next poll
+
+        Args:
+            fresh (bool): Whether the poll that just ran returned new reports
+            now (float): Current epoch, for testing
+
+        Returns:
+            float: Delay for the scheduler
+        """
+        now = time() if now is None else now
+
+        sun = sun_times(self.zip_code, self.units, now)
+        if sun is not None and now >= sun[1]:
+            self.misses = 0
+            return max(self.min_delay, sun[0] + DAY - now + self.margin)
+
+        if fresh:
+            self.misses = 0
+        else:
+            self.misses += 1
+
+        # A sweep polls every system, so aim at the median expected report,
+        # not the earliest: staggered reporters would otherwise keep the
+        # fleet pinned at min_delay
+        expected = [due for due in map(self.expected, self.reports) if due]
+        due = median(expected) if expected else None
+        if due is not None and due > now and not self.misses:
+            delay = due - now
+        else:
+            delay = self.min_delay * 2 ** self.misses
+
+        if len(self.reports) > 1:
+            # Reports are only seen at sweeps, so no system ever shows a
+            # cadence shorter than the sweep spacing, and in a staggered fleet
+            # someone is always about to report. A sweep polls everyone, so
+            # the fleet never sweeps more often than the configured interval.
+            delay = max(delay, self.default)
+
+        return min(self.max_delay, max(self.min_delay, delay))
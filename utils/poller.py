@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""This script polls the Enphase summary endpoint for many systems at once"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import asyncio
+import random
+from collections import namedtuple
+from time import time, perf_counter
+from rich.console import Console
+from utils.httpclient import QUOTA_WINDOW, async_session, record
+
+console = Console()
+
+ENPHASE_URL = "https://api.enphaseenergy.com/api/v2/systems/{system}/summary"
+
+# Enphase answers 409 when the per-minute quota is spent and 429 on bursts
+RATE_LIMIT_CODES = (409, 429)
+
+Site = namedtuple("Site", ["system", "key", "user"])
+
+
+def load_sites(config):
+    """Build the list of systems to poll from config.ini
+
+    The DEFAULT ``system`` option takes a comma separated list of system ids.
+    A ``[SYSTEM <id>]`` section adds a system, and may override ``key`` and
+    ``user_id`` for it; anything not set falls back to DEFAULT.
+
+    Args:
+        config (ConfigParser): Parsed config.ini
+
+    Returns:
+        list: Site tuples, one per system
+    """
+    sites = {}
+    for system in config["DEFAULT"]["system"].split(","):
+        system = system.strip()
+        if system:
+            sites[system] = Site(
+                system, config["DEFAULT"]["key"], config["DEFAULT"]["user_id"]
+            )
+    for section in config.sections():
+        if section.upper().startswith("SYSTEM "):
+            system = section.split(" ", maxsplit=1)[1].strip()
+            sites[system] = Site(
+                system, config[section]["key"], config[section]["user_id"]
+            )
+    return list(sites.values())
+
+
+def backoff(attempt):
+    """Seconds to wait before retrying a failure, with full jitter"""
+    return random.uniform(0, 2 ** attempt)
+
+
+def quota_reset(retry_after=None, body=None, now=None):
+    """Epoch at which a rate limited API key may be used again
+
+    Honors a Retry-After header, then the ``period_end`` Enphase puts in a
+    409 body, and otherwise waits a whole quota window.
+    """
+    now = time() if now is None else now
+    if retry_after:
+        try:
+            return now + float(retry_after)
+        except ValueError:
+            pass
+    if isinstance(body, dict) and isinstance(body.get("period_end"), (int, float)):
+        return max(now, body["period_end"] + 1)
+    return now + QUOTA_WINDOW
+
+
+class KeyLimiter:
+    """In-flight cap for one API key, paused while its quota is spent
+
+    Every request for the key waits in ``async with`` until the quota
+    period that rate limited it has ended, so the rest of a sweep does not
+    spend its retries inside the same period.
+
+    Args:
+        per_key (int): Max in-flight requests for the key
+    """
+
+    def __init__(self, per_key):
+        self.semaphore = asyncio.Semaphore(per_key)
+        self.resume_at = 0
+
+    def pause(self, until):
+        """Hold every request for the key until an epoch"""
+        self.resume_at = max(self.resume_at, until)
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        while self.resume_at > time():
+            await asyncio.sleep(self.resume_at - time())
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
+
+
+async def fetch_json(session, site, url, params, limiter, retries, endpoint):
+    """GET one Enphase endpoint, retrying on rate limits and server errors
+
+    Args:
+        session (aiohttp.ClientSession): Shared, pooled HTTP client
+        site (Site): System the request is for
+        url (str): Request URL
+        params (dict): Query parameters, including the API key
+        limiter (KeyLimiter): In-flight cap for the site's API key
+        retries (int): Attempts after the first one
+        endpoint (str): Name latency is recorded under
+
+    Returns:
+        dict: Response json, None if it could not be fetched
+    """
+    import aiohttp  # pylint: disable=import-outside-toplevel
+
+    for attempt in range(retries + 1):
+        limited = False
+        async with limiter:
+            start = perf_counter()
+            try:
+                async with session.get(url, params=params) as response:
+                    record(endpoint, perf_counter() - start)
+                    if response.status == 200:
+                        return await response.json(content_type=None)
+                    if response.status in RATE_LIMIT_CODES:
+                        limited = True
+                        try:
+                            body = await response.json(content_type=None)
+                        except ValueError:
+                            body = None
+                        reset = quota_reset(response.headers.get("Retry-After"), body)
+                        limiter.pause(reset)
+                        console.log(
+                            f"[bright_yellow]--- System {site.system} rate limited "
+                            f"({response.status}), key paused "
+                            f"{reset - time():.0f}s ---[/]"
+                        )
+                    elif response.status < 500:
+                        console.log(
+                            f"[red]--- System {site.system} {endpoint} refused "
+                            f"({response.status}) ---[/]"
+                        )
+                        return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                console.log(
+                    f"[red]--- System {site.system} {endpoint} failed: {error} ---[/]"
+                )
+
+        # A rate limited retry waits in the limiter for the quota to reset
+        if attempt < retries and not limited:
+            await asyncio.sleep(backoff(attempt))
+
+    return None
+
+
+async def fetch_summary(session, site, limiter, retries):
+    """Fetch one system summary
+
+    Returns:
+        tuple: (site, summary json or None)
+    """
+    summary = await fetch_json(
+        session,
+        site,
+        ENPHASE_URL.format(system=site.system),
+        {"key": site.key, "user_id": site.user},
+        limiter,
+        retries,
+        "enphase",
+    )
+    return (site, summary)
+
+
+async def poll_sites(
+    sites, per_key=2, max_connections=50, per_host=None, timeout=10, retries=3
+):
+    """Poll every site concurrently over one pooled HTTP client
+
+    Args:
+        sites (list): Site tuples to poll
+        per_key (int): Max in-flight requests per API key
+        max_connections (int): Size of the shared connection pool
+        per_host (int): Connections to one host, the whole pool if None
+        timeout (int): Total seconds allowed per request
+        retries (int): Attempts after the first one
+
+    Returns:
+        list: (site, summary json or None) for every site
+    """
+    limiters = {}
+    for site in sites:
+        limiters.setdefault(site.key, KeyLimiter(per_key))
+
+    async with async_session(max_connections, per_host, timeout) as session:
+        return await asyncio.gather(
+            *(
+                fetch_summary(session, site, limiters[site.key], retries)
+                for site in sites
+            )
+        )
+
+
+def sweep(sites, **kwargs):
+    """Run one polling sweep across all sites from synchronous code"""
+    start = time()
+    results = asyncio.run(poll_sites(sites, **kwargs))
+    failed = sum(1 for _, respjson in results if respjson is None)
+    console.log(
+        f"--- Polled [bold cyan]{len(results)}[/bold cyan] systems in "
+        f"[bold cyan]{(time() - start):.3f} seconds[/bold cyan], {failed} failed ---"
+    )
+    return results
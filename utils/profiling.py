@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""This script profiles MongoDB operations and captures slow query plans"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import json
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from time import perf_counter, time
+from pymongo.errors import PyMongoError
+from rich.console import Console
+from utils.metrics import percentile
+
+console = Console()
+
+# Durations kept per operation for the percentiles in the report
+WINDOW = 1000
+
+
+def shape(query):
+    """Query with every value replaced by its type, so plans are keyed by shape"""
+    if isinstance(query, dict):
+        return {key: shape(value) for key, value in sorted(query.items())}
+    if isinstance(query, (list, tuple)):
+        return [shape(value) for value in query[:1]]
+    return type(query).__name__
+
+
+def plan_stages(plan):
+    """Stage names of every winning plan in an explain result"""
+    stages = []
+
+    def walk(node, winning):
+        if isinstance(node, dict):
+            if winning and "stage" in node:
+                stages.append(node["stage"])
+            for key, value in node.items():
+                walk(value, winning or key == "winningPlan")
+        elif isinstance(node, list):
+            for value in node:
+                walk(value, winning)
+
+    walk(plan, False)
+    return stages
+
+
+class Profiler:
+    """Per-operation latency, with plans for slow operations, written to a file
+
+    Every call through a ProfiledCollection is timed. The first time a
+    query shape runs slower than ``slow_ms``, and again after
+    ``explain_interval`` seconds, its plan is captured with ``explain`` and
+    a collection scan is flagged on the console. ``write()`` saves the
+    summary as JSON.
+
+    Args:
+        path (str): JSON report file
+        slow_ms (int): Operations at least this slow get their plan captured
+        explain_interval (int): Seconds before a shape is explained again
+    """
+
+    def __init__(self, path, slow_ms=100, explain_interval=3600):
+        self.path = path
+        self.slow = slow_ms / 1000
+        self.explain_interval = explain_interval
+        self.ops = {}
+        self.plans = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, query, seconds, explain):
+        """Add one timing, capturing the plan if it was slow
+
+        Args:
+            name (str): ``<collection>.<operation>``
+            query (dict): Filter the operation ran with
+            seconds (float): Duration
+            explain (callable): Returns the explain output for the operation
+        """
+        with self.lock:
+            op = self.ops.get(name)
+            if op is None:
+                op = self.ops[name] = {
+                    "count": 0,
+                    "seconds": 0.0,
+                    "max": 0.0,
+                    "slow": 0,
+                    "recent": deque(maxlen=WINDOW),
+                }
+            op["count"] += 1
+            op["seconds"] += seconds
+            op["max"] = max(op["max"], seconds)
+            op["recent"].append(seconds)
+            if seconds < self.slow:
+                return
+            op["slow"] += 1
+            if explain is None:
+                return
+            key = name + " " + json.dumps(shape(query or {}))
+            plan = self.plans.get(key)
+            if plan is not None and time() - plan["explained"] < self.explain_interval:
+                return
+            self.plans[key] = plan = {
+                "operation": name,
+                "shape": shape(query or {}),
+                "explained": time(),
+                "seconds": round(seconds, 6),
+                "stages": None,
+                "collscan": False,
+            }
+
+        try:
+            stages = plan_stages(explain())
+        except PyMongoError as error:
+            console.log(f"[bright_yellow]--- Explain of {name} failed: {error} ---[/]")
+            return
+        plan["stages"] = stages
+        plan["collscan"] = "COLLSCAN" in stages
+        if plan["collscan"]:
+            console.log(
+                f"[bold red]--- COLLSCAN: {name} {json.dumps(plan['shape'])} "
+                f"took {seconds:.3f}s ---[/bold red]"
+            )
+
+    def summary(self):
+        """Report contents as a JSON-ready dict"""
+        with self.lock:
+            ops = {}
+            for name, op in sorted(self.ops.items()):
+                recent = sorted(op["recent"])
+                ops[name] = {
+                    "count": op["count"],
+                    "mean_ms": round(op["seconds"] / op["count"] * 1000, 3),
+                    "p50_ms": round(percentile(recent, 0.5) * 1000, 3),
+                    "p99_ms": round(percentile(recent, 0.99) * 1000, 3),
+                    "max_ms": round(op["max"] * 1000, 3),
+                    "slow": op["slow"],
+                }
+            plans = sorted(
+                (dict(plan) for plan in self.plans.values()),
+                key=lambda plan: (not plan["collscan"], -plan["seconds"]),
+            )
+        for plan in plans:
+            plan["explained"] = datetime.fromtimestamp(plan["explained"]).isoformat()
+        return {
+            "written": datetime.now().isoformat(),
+            "slow_ms": self.slow * 1000,
+            "operations": ops,
+            "plans": plans,
+            "collscans": sum(plan["collscan"] for plan in plans),
+        }
+
+    def write(self):
+        """Save the report, replacing the previous one"""
+        tmp_path = self.path + ".tmp"
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as report_file:
+                json.dump(self.summary(), report_file, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as error:
+            console.log(f"[bright_yellow]--- Profile report not saved: {error} ---[/]")
+
+
+class ProfiledCursor:
+    """Cursor that times the query when its first batch is fetched"""
+
+    def __init__(self, cursor, profiler, name, query):
+        self.cursor = cursor
+        self.profiler = profiler
+        self.name = name
+        self.query = query
+        self.started = False
+
+    def __getattr__(self, attr):
+        value = getattr(self.cursor, attr)
+        if not callable(value):
+            return value
+
+        def chained(*args, **kwargs):
+            result = value(*args, **kwargs)
+            # sort(), limit() and friends return the cursor; keep wrapping it
+            return self if result is self.cursor else result
+
+        return chained
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.started:
+            return next(self.cursor)
+        self.started = True
+        start = perf_counter()
+        try:
+            return next(self.cursor)
+        finally:
+            self.profiler.record(
+                self.name, self.query, perf_counter() - start, self.cursor.explain
+            )
+
+
+class ProfiledCollection:
+    """Collection handle that reports every operation to a Profiler
+
+    Reads are explained with ``find().explain()``; deletes and updates use
+    the ``explain`` command at queryPlanner verbosity so nothing is
+    modified. Anything not wrapped passes straight through.
+
+    Args:
+        collection (Collection): Collection to profile
+        profiler (Profiler): Where timings and plans go
+    """
+
+    def __init__(self, collection, profiler):
+        self.collection = collection
+        self.profiler = profiler
+
+    def __getattr__(self, attr):
+        return getattr(self.collection, attr)
+
+    def timed(self, op, query, explain, call, *args, **kwargs):
+        """Run a collection method and record it"""
+        start = perf_counter()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            self.profiler.record(
+                f"{self.collection.name}.{op}", query, perf_counter() - start, explain
+            )
+
+    def explain_find(self, query, limit=0):
+        """Plan of a read with this filter"""
+        return lambda: self.collection.find(query or {}).limit(limit).explain()
+
+    def explain_write(self, command, spec):
+        """Plan of a delete or update without running it"""
+        return lambda: self.collection.database.command(
+            "explain",
+            {command: self.collection.name, command + "s": [spec]},
+            verbosity="queryPlanner",
+        )
+
+    def find(self, *args, **kwargs):
+        """Cursor whose first fetch is timed"""
+        query = args[0] if args else kwargs.get("filter")
+        return ProfiledCursor(
+            self.collection.find(*args, **kwargs),
+            self.profiler,
+            f"{self.collection.name}.find",
+            query,
+        )
+
+    def find_one(self, *args, **kwargs):
+        """Timed find_one"""
+        query = args[0] if args else kwargs.get("filter")
+        return self.timed(
+            "find_one",
+            query,
+            self.explain_find(query, 1),
+            self.collection.find_one,
+            *args,
+            **kwargs,
+        )
+
+    def count_documents(self, filter, **kwargs):  # pylint: disable=redefined-builtin
+        """Timed count_documents"""
+        return self.timed(
+            "count_documents",
+            filter,
+            self.explain_find(filter),
+            self.collection.count_documents,
+            filter,
+            **kwargs,
+        )
+
+    def delete_many(self, filter, **kwargs):  # pylint: disable=redefined-builtin
+        """Timed delete_many"""
+        return self.timed(
+            "delete_many",
+            filter,
+            self.explain_write("delete", {"q": filter, "limit": 0}),
+            self.collection.delete_many,
+            filter,
+            **kwargs,
+        )
+
+    def update_one(self, filter, update, **kwargs):  # pylint: disable=redefined-builtin
+        """Timed update_one"""
+        return self.timed(
+            "update_one",
+            filter,
+            self.explain_write("update", {"q": filter, "u": update}),
+            self.collection.update_one,
+            filter,
+            update,
+            **kwargs,
+        )
+
+    def bulk_write(self, requests, **kwargs):
+        """Timed bulk_write; batches have no single plan"""
+        return self.timed(
+            "bulk_write", None, None, self.collection.bulk_write, requests, **kwargs
+        )
+
+    def insert_many(self, documents, **kwargs):
+        """Timed insert_many"""
+        return self.timed(
+            "insert_many", None, None, self.collection.insert_many, documents, **kwargs
+        )
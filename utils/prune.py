@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""This script expires old solar documents without stalling ingestion"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import threading
+from time import time, sleep
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+from rich import box
+from rich.console import Console
+from rich.table import Table
+from utils.metrics import MONGO_SECONDS, PRUNE_SECONDS
+
+console = Console()
+
+# Fields kept when expiring documents are archived
+PROJECTION = {
+    "System": 1,
+    "EpochLastReport": 1,
+    "Collected": 1,
+    "Status": 1,
+    "Reporting": 1,
+    "WeatherId": 1,
+}
+
+
+class Pruner:
+    """Delete documents older than the retention window in bounded chunks
+
+    When the collection already expires documents server-side (time-series
+    ``expireAfterSeconds`` or a TTL index) there is nothing to delete.
+    Otherwise each run deletes at most ``chunk`` documents per round trip and
+    sleeps between chunks so no more than ``max_rate`` documents go per
+    second. A ``retention`` of 0 or less keeps everything and nothing is
+    ever deleted, matching utils.schema.bootstrap.
+
+    With an ``archive``, every chunk is written to it before it is deleted.
+    Under server-side expiry, documents are instead exported ``archive_lead``
+    seconds before they expire, resuming from the newest one archived so far.
+
+    Args:
+        collection (Collection): Solar collection
+        retention (int): Seconds of history to keep
+        ttl (bool): True when the server expires documents itself
+        chunk (int): Documents deleted per round trip
+        max_rate (int): Documents deleted per second at most
+        archive (Archive): Columnar archive for expiring documents
+        archive_lead (int): Seconds before expiry to archive under TTL
+    """
+
+    def __init__(
+        self,
+        collection,
+        retention=345600,
+        ttl=False,
+        chunk=1000,
+        max_rate=5000,
+        archive=None,
+        archive_lead=86400,
+    ):
+        self.collection = collection
+        self.retention = retention
+        self.ttl = ttl
+        self.chunk = chunk
+        self.max_rate = max_rate
+        self.archive = archive
+        self.archive_lead = archive_lead
+        self.worker = None
+        self.last = {}
+
+    def running(self):
+        """True while a background prune is in progress"""
+        return self.worker is not None and self.worker.is_alive()
+
+    def throttle(self, count, chunk_start):
+        """Sleep long enough to keep under max_rate documents per second"""
+        pause = count / self.max_rate - (time() - chunk_start)
+        if pause > 0:
+            sleep(pause)
+
+    def expire(self, cutoff):
+        """Archive, then delete, expired documents chunk by chunk
+
+        Returns:
+            tuple: (documents deleted, chunks)
+        """
+        query = {"EpochLastReport": {"$lt": cutoff}}
+        projection = PROJECTION if self.archive else {"_id": 1}
+        deleted = 0
+        chunks = 0
+
+        while True:
+            chunk_start = time()
+            with MONGO_SECONDS.time(op="prune_find"):
+                docs = list(self.collection.find(query, projection).limit(self.chunk))
+            if not docs:
+                break
+            if self.archive is not None:
+                self.archive.write(docs)
+            with MONGO_SECONDS.time(op="prune_delete"):
+                result = self.collection.delete_many(
+                    {"_id": {"$in": [doc["_id"] for doc in docs]}}
+                )
+            deleted += result.deleted_count
+            chunks += 1
+            self.throttle(len(docs), chunk_start)
+
+        return (deleted, chunks)
+
+    def export(self, cutoff):
+        """Archive documents that server-side expiry will remove soon
+
+        Returns:
+            tuple: (documents archived, chunks)
+        """
+        cursor = (
+            self.collection.find(
+                {"EpochLastReport": {"$gt": self.archive.watermark(), "$lt": cutoff}},
+                PROJECTION,
+            )
+            .sort("EpochLastReport", ASCENDING)
+            .batch_size(self.chunk)
+        )
+        archived = 0
+        chunks = 0
+        docs = []
+        chunk_start = time()
+
+        for doc in cursor:
+            docs.append(doc)
+            if len(docs) >= self.chunk:
+                self.archive.write(docs)
+                archived += len(docs)
+                chunks += 1
+                self.throttle(len(docs), chunk_start)
+                docs = []
+                chunk_start = time()
+        if docs:
+            self.archive.write(docs)
+            archived += len(docs)
+            chunks += 1
+        self.archive.set_watermark(cutoff - 1)
+
+        return (archived, chunks)
+
+    def prune(self):
+        """Run one retention pass
+
+        Returns:
+            int: Number of documents deleted or, under TTL, archived
+        """
+        if self.retention <= 0:
+            return 0
+        start = time()
+        cutoff = int(start - self.retention)
+        done = 0
+        chunks = 0
+
+        try:
+            if self.ttl:
+                cutoff += self.archive_lead
+                done, chunks = self.export(cutoff)
+            else:
+                done, chunks = self.expire(cutoff)
+        except PyMongoError as error:
+            console.log(f"[red]--- Prune interrupted: {error} ---[/]")
+        except OSError as error:
+            console.log(
+                f"[red]--- Archive failed, nothing more deleted: {error} ---[/]"
+            )
+
+        PRUNE_SECONDS.observe(time() - start, mode="export" if self.ttl else "expire")
+        self.last = {
+            "Pruning time": str(cutoff),
+            "Docs archived" if self.ttl else "Docs deleted": str(done),
+            "Chunks": str(chunks),
+            "Seconds": f"{(time() - start):.3f}",
+        }
+
+        prune_table = Table(title="Prune Statistics", box=box.SIMPLE, style="cyan")
+
+        prune_table.add_column("Type", style="cyan3")
+        prune_table.add_column("Data", justify="right", style="cyan3")
+
+        for name, value in self.last.items():
+            prune_table.add_row(name, value)
+
+        console.print(prune_table)
+
+        return done
+
+    def start(self):
+        """Prune on a background thread
+
+        Returns:
+            bool: False if retention is disabled, expiry is server-side or a
+            prune is still running
+        """
+        if self.retention <= 0:
+            console.log("[green]--- Retention disabled, nothing pruned ---[/]")
+            return False
+        if self.ttl and self.archive is None:
+            console.log("[green]--- Retention handled by server-side TTL ---[/]")
+            return False
+        if self.running():
+            console.log("[bright_yellow]--- Previous prune still running ---[/]")
+            return False
+        self.worker = threading.Thread(target=self.prune, name="pruner", daemon=True)
+        self.worker.start()
+        return True
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""This script keeps hourly and daily solar rollups up to date"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from rich.console import Console
+from utils.metrics import MONGO_SECONDS
+
+console = Console()
+
+# Upper bounds, in seconds, of the report lag histogram buckets
+LAG_BUCKETS = (300, 900, 1800, 3600, 7200, 21600, 86400)
+
+
+def lag_bucket(lag):
+    """Histogram bucket name for a report lag"""
+    for bound in LAG_BUCKETS:
+        if lag <= bound:
+            return str(bound)
+    return "inf"
+
+
+def lag_percentile(rollup, fraction):
+    """Upper bound of the lag bucket holding the given percentile
+
+    Returns:
+        float: Seconds, infinity for the overflow bucket, None without samples
+    """
+    hist = rollup.get("lag_hist", {})
+    total = sum(hist.values())
+    if not total:
+        return None
+    seen = 0
+    for bound in [str(bound) for bound in LAG_BUCKETS] + ["inf"]:
+        seen += hist.get(bound, 0)
+        if seen >= fraction * total:
+            return float(bound)
+    return float("inf")
+
+
+def uptime(rollup):
+    """Share of samples in a rollup that were reporting"""
+    if not rollup or not rollup.get("samples"):
+        return None
+    return rollup.get("reporting", 0) / rollup["samples"]
+
+
+class Rollup:
+    """Incremental per-system hourly and daily aggregates
+
+    Every sample becomes one ``$inc``/``$max`` upsert per period, so reading
+    a system's production, uptime ratio or report lag for an hour or a day is
+    a single point lookup by ``_id`` instead of a scan of raw history.
+
+    The last energy seen per system only moves on once a batch is written.
+    With a ``spool``, a batch that cannot be written is kept on disk with
+    its poll time and folded in, in order, before the next one.
+
+    Args:
+        db (Database): MongoDB database
+        prefix (str): Collections are ``<prefix>_hourly`` and ``<prefix>_daily``
+        spool (Spool): On-disk queue for samples not yet rolled up
+    """
+
+    def __init__(self, db, prefix, spool=None):
+        self.hourly = db[prefix + "_hourly"]
+        self.daily = db[prefix + "_daily"]
+        self.spool = spool
+        self.energy = {}
+
+    @staticmethod
+    def keys(system, epoch):
+        """Hourly and daily ``_id`` for a system at a report time"""
+        when = datetime.fromtimestamp(epoch)
+        return (
+            f"{system}|{when.strftime('%Y-%m-%dT%H')}",
+            f"{system}|{when.strftime('%Y-%m-%d')}",
+        )
+
+    def previous_energy(self, system, day_key, staged=None):
+        """Last energy_today seen for a system on a day
+
+        Seeded from the daily rollup after a restart so hourly deltas do not
+        double count the energy collected before it. ``staged`` holds values
+        from the batch being built, which win over written ones.
+        """
+        if staged and system in staged:
+            last_day, energy = staged[system]
+            return energy if last_day == day_key else 0
+        if system not in self.energy:
+            rollup = self.daily.find_one({"_id": day_key}, {"energy": 1})
+            self.energy[system] = (day_key, rollup["energy"] if rollup else 0)
+        last_day, energy = self.energy[system]
+        return energy if last_day == day_key else 0
+
+    def updates(self, doc, current_epoch, staged=None):
+        """Build the hourly and daily upserts for one sample
+
+        The new energy mark goes into ``staged``, or straight into the
+        written marks when none is given.
+        """
+        system = doc.get("System")
+        epoch = doc["EpochLastReport"]
+        hour_key, day_key = self.keys(system, epoch)
+
+        energy = doc["Collected"]
+        previous = self.previous_energy(system, day_key, staged)
+        delta = max(0, energy - previous)
+        (self.energy if staged is None else staged)[system] = (
+            day_key,
+            max(energy, previous),
+        )
+
+        lag = max(0, current_epoch - epoch)
+        counters = {
+            "samples": 1,
+            "reporting": int(bool(doc["Reporting"])),
+            f"status.{doc['Status']}": 1,
+            f"lag_hist.{lag_bucket(lag)}": 1,
+            "lag_sum": lag,
+        }
+        on_insert = {"system": system}
+
+        return (
+            UpdateOne(
+                {"_id": hour_key},
+                {
+                    "$inc": dict(counters, energy=delta),
+                    "$max": {"lag_max": lag},
+                    "$setOnInsert": dict(on_insert, hour=hour_key.split("|")[1]),
+                },
+                upsert=True,
+            ),
+            UpdateOne(
+                {"_id": day_key},
+                {
+                    "$inc": counters,
+                    "$max": {"energy": energy, "lag_max": lag},
+                    "$setOnInsert": dict(on_insert, day=day_key.split("|")[1]),
+                },
+                upsert=True,
+            ),
+        )
+
+    def write(self, samples):
+        """Write the rollups of (sample, poll epoch) pairs
+
+        Returns:
+            bool: False if the rollups could not be written
+        """
+        hourly, daily = [], []
+        staged = {}
+        try:
+            for doc, current_epoch in samples:
+                hour_op, day_op = self.updates(doc, current_epoch, staged)
+                hourly.append(hour_op)
+                daily.append(day_op)
+            if hourly:
+                with MONGO_SECONDS.time(op="rollup"):
+                    self.hourly.bulk_write(hourly, ordered=False)
+                    self.daily.bulk_write(daily, ordered=False)
+        except PyMongoError as error:
+            console.log(f"[red]--- Rollups not updated: {error} ---[/]")
+            return False
+        self.energy.update(staged)
+        return True
+
+    def replay_batch(self, batch):
+        """Write spooled samples, returning them if they still cannot be"""
+        if self.write([(entry["doc"], entry["polled"]) for entry in batch]):
+            return []
+        return batch
+
+    def apply(self, docs, current_epoch):
+        """Fold a batch of samples into the rollups
+
+        Spooled samples go first, so energy deltas stay in report order.
+
+        Returns:
+            bool: False if the rollups could not be written
+        """
+        if self.spool is not None and self.spool.pending():
+            self.spool.replay(self.replay_batch)
+        written = False
+        if self.spool is None or not self.spool.pending():
+            written = self.write([(doc, current_epoch) for doc in docs])
+        if not written and self.spool is not None and docs:
+            self.spool.append([{"doc": doc, "polled": current_epoch} for doc in docs])
+        return written
+
+    def day(self, system, epoch):
+        """Daily rollup for a system, by point lookup"""
+        return self.daily.find_one({"_id": self.keys(system, epoch)[1]})
+
+    def hour(self, system, epoch):
+        """Hourly rollup for a system, by point lookup"""
+        return self.hourly.find_one({"_id": self.keys(system, epoch)[0]})
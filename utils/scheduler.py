@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""This script runs periodic jobs on their own cadence"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import heapq
+import itertools
+import random
+import threading
+from datetime import datetime
+from time import time
+from rich.console import Console
+
+console = Console()
+
+
+class Job:
+    """One periodic job
+
+    Args:
+        name (str): Job name used in log lines
+        func (callable): Work to run; if it returns a number, that many
+            seconds are used as the delay before the next run instead of
+            the regular interval
+        interval (float): Seconds between runs
+        jitter (float): Up to this many random seconds added to each run
+        align (bool): Run on wall-clock multiples of the interval, e.g. on
+            the hour for 3600, instead of relative to the first run
+        offset (float): Seconds after each aligned boundary to run at
+        count (int): Stop after this many runs, None runs forever
+    """
+
+    def __init__(
+        self, name, func, interval, jitter=0, align=False, offset=0, count=None
+    ):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.align = align
+        self.offset = offset
+        self.count = count
+        self.slot = None
+        self.runs = 0
+
+    def next_slot(self, now, delay=None):
+        """Pick the next slot, skipping any that were missed entirely
+
+        Slots advance from the previous slot rather than from the time the
+        job finished, so run time and oversleeping do not accumulate drift.
+        """
+        if delay is not None:
+            self.slot = now + delay
+        elif self.align:
+            self.slot = (now - self.offset) // self.interval * self.interval
+            self.slot += self.interval + self.offset
+        else:
+            self.slot += self.interval
+            if self.slot <= now:
+                self.slot += (now - self.slot) // self.interval * self.interval
+                self.slot += self.interval
+        return self.slot + random.uniform(0, self.jitter)
+
+
+class Scheduler:
+    """Run jobs from one thread, sleeping until the next one is due"""
+
+    def __init__(self):
+        self.queue = []
+        self.jobs = {}
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+
+    def add(self, name, func, interval, first=None, **kwargs):
+        """Schedule a job
+
+        Args:
+            name (str): Unique job name, replaces a job of the same name
+            func (callable): Work to run
+            interval (float): Seconds between runs
+            first (float): Epoch of the first run, defaults to now
+
+        Returns:
+            Job: The scheduled job
+        """
+        job = Job(name, func, interval, **kwargs)
+        job.slot = time() if first is None else first
+        with self.lock:
+            self.jobs[name] = job
+            heapq.heappush(self.queue, (job.slot, next(self.sequence), job))
+        self.wakeup.set()
+        return job
+
+    def update(self, name, **settings):
+        """Change a scheduled job's interval, jitter, offset and so on
+
+        The slot already queued is kept, the new settings apply from the
+        run after it.
+
+        Returns:
+            bool: False if no job of that name is scheduled
+        """
+        with self.lock:
+            job = self.jobs.get(name)
+            if job is None:
+                return False
+            for setting, value in settings.items():
+                setattr(job, setting, value)
+        return True
+
+    def cancel(self, name):
+        """Stop scheduling a job; a run in progress finishes normally"""
+        with self.lock:
+            self.jobs.pop(name, None)
+
+    def run_job(self, job):
+        """Run one job and put it back in the queue"""
+        delay = None
+        try:
+            delay = job.func()
+        except Exception:  # pylint: disable=broad-except
+            console.print_exception()
+        job.runs += 1
+
+        with self.lock:
+            if self.jobs.get(job.name) is not job:
+                return
+            if job.count is not None and job.runs >= job.count:
+                del self.jobs[job.name]
+                return
+            due = job.next_slot(time(), delay)
+            heapq.heappush(self.queue, (due, next(self.sequence), job))
+
+        if job.interval >= 60:
+            nextrun = datetime.fromtimestamp(due).strftime("%m-%d-%Y %H:%M:%S")
+            console.log(f"--- Next {job.name}: [bold cyan]{nextrun}[/bold cyan] ---")
+
+    def run_forever(self):
+        """Run due jobs until stop() is called"""
+        while not self.stopped:
+            with self.lock:
+                while self.queue and self.jobs.get(self.queue[0][2].name) is not (
+                    self.queue[0][2]
+                ):
+                    heapq.heappop(self.queue)
+                if not self.queue:
+                    due, job = None, None
+                else:
+                    due, _, job = self.queue[0]
+                    if due <= time():
+                        heapq.heappop(self.queue)
+                    else:
+                        job = None
+                self.wakeup.clear()
+
+            if job is not None:
+                self.run_job(job)
+            else:
+                self.wakeup.wait(None if due is None else due - time())
+
+    def stop(self):
+        """Stop run_forever() after the current job"""
+        self.stopped = True
+        self.wakeup.set()
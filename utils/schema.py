@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""This script creates the solar collection and its indexes"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from rich.console import Console
+
+console = Console()
+
+RETENTION = 345600  # 4-days
+
+TIME_FIELD = "LastReport"
+META_FIELD = "System"
+
+
+def create_collection(db, name, retention, timeseries):
+    """Create the collection, preferring a time-series layout
+
+    Time-series collections need MongoDB 5.0 or later. Older servers get a
+    plain collection instead. A ``retention`` of 0 creates it without
+    expiry.
+
+    Returns:
+        str: "timeseries" or "plain"
+    """
+    if timeseries:
+        options = {}
+        if retention > 0:
+            options["expireAfterSeconds"] = retention
+        try:
+            db.create_collection(
+                name,
+                timeseries={
+                    "timeField": TIME_FIELD,
+                    "metaField": META_FIELD,
+                    "granularity": "hours",
+                },
+                **options,
+            )
+            return "timeseries"
+        except OperationFailure as error:
+            console.log(
+                f"[bright_yellow]--- Time-series collection unavailable: "
+                f"{error} ---[/]"
+            )
+    db.create_collection(name)
+    return "plain"
+
+
+def set_expiry(db, name, retention):
+    """Point a time-series collection's expiry at the retention window
+
+    Expiry happens on the server in whole buckets. Chunked deletes would
+    have to filter on more than the metaField, which MongoDB before 7.0
+    refuses on a time-series collection. A ``retention`` of 0 turns expiry
+    off.
+
+    Returns:
+        bool: True if the server accepted the change
+    """
+    try:
+        db.command(
+            "collMod", name, expireAfterSeconds=retention if retention > 0 else "off"
+        )
+    except OperationFailure as error:
+        console.log(f"[bright_yellow]--- Expiry of {name} not changed: {error} ---[/]")
+        return False
+    console.log(f"[green]--- Expiry of {name} set to {retention} seconds ---[/]")
+    return True
+
+
+def collection_info(db, name):
+    """Return the listCollections entry for a collection, or None"""
+    for info in db.list_collections(filter={"name": name}):
+        return info
+    return None
+
+
+def ensure_index(collection, keys, **kwargs):
+    """Create one index, logging instead of failing when the server refuses"""
+    try:
+        return collection.create_index(keys, **kwargs)
+    except OperationFailure as error:
+        console.log(f"[bright_yellow]--- Index {keys} not created: {error} ---[/]")
+        return None
+
+
+def bootstrap(db, name, retention=RETENTION, timeseries=True):
+    """Create the solar collection and its indexes if they are missing
+
+    Safe to run on every start: existing collections keep their layout, a
+    time-series collection's expiry follows ``retention``, and
+    ``create_index`` is a no-op for indexes that already exist.
+
+    Args:
+        db (Database): MongoDB database
+        name (str): Collection name
+        retention (int): Seconds to keep documents, 0 disables expiry
+        timeseries (bool): Create a time-series collection if it is missing
+
+    Returns:
+        dict: Collection kind and whether server-side expiry is active
+    """
+    info = collection_info(db, name)
+    if info is None:
+        kind = create_collection(db, name, retention, timeseries)
+        console.log(f"[green]--- Created {kind} collection {name} ---[/]")
+        info = collection_info(db, name) or {}
+    else:
+        kind = "timeseries" if info.get("type") == "timeseries" else "plain"
+
+    collection = db[name]
+
+    ensure_index(
+        collection,
+        [(META_FIELD, ASCENDING), ("EpochLastReport", DESCENDING)],
+        name="system_epoch",
+    )
+
+    ttl = False
+    if kind == "timeseries":
+        ensure_index(
+            collection,
+            [(META_FIELD, ASCENDING), (TIME_FIELD, DESCENDING)],
+            name="system_time",
+        )
+        # Retention may have changed since the collection was created
+        expiry = info.get("options", {}).get("expireAfterSeconds")
+        wanted = retention if retention > 0 else None
+        if expiry != wanted and set_expiry(db, name, retention):
+            expiry = wanted
+        ttl = expiry is not None
+    elif retention > 0:
+        ttl = (
+            ensure_index(
+                collection,
+                [(TIME_FIELD, ASCENDING)],
+                name="ttl_last_report",
+                expireAfterSeconds=retention,
+            )
+            is not None
+        )
+
+    return {"kind": kind, "ttl": ttl}
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""This script spreads the fleet across worker processes by consistent hashing"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import bisect
+import hashlib
+import multiprocessing
+import queue
+from time import time
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+
+def ring_hash(key):
+    """Stable 64-bit position of a key on the ring"""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes
+
+    Each node owns ``replicas`` points on the ring and a key belongs to the
+    first point at or after its hash. Adding or removing a node only moves
+    the keys next to its points, about 1/N of the fleet, so a system stays
+    on the same worker, with its warm rollup state, across rebalances.
+
+    Args:
+        nodes (list): Node names
+        replicas (int): Virtual nodes per node
+    """
+
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self.points = []
+        self.owners = {}
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        """Put a node on the ring"""
+        for replica in range(self.replicas):
+            point = ring_hash(f"{node}#{replica}")
+            if point not in self.owners:
+                bisect.insort(self.points, point)
+                self.owners[point] = node
+
+    def remove(self, node):
+        """Take a node off the ring"""
+        self.points = [point for point in self.points if self.owners[point] != node]
+        self.owners = {point: self.owners[point] for point in self.points}
+
+    def nodes(self):
+        """Nodes on the ring"""
+        return sorted(set(self.owners.values()))
+
+    def node_for(self, key):
+        """Node owning a key, None on an empty ring"""
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, ring_hash(str(key))) % len(self.points)
+        return self.owners[self.points[index]]
+
+
+class ShardPool:
+    """Coordinator for a pool of worker processes, one shard each
+
+    Every worker runs ``target(name, settings, inbox, outbox)`` in its own
+    process and answers messages on ``inbox``:
+
+    * ``("assign", sites)`` replaces the worker's share of the fleet
+    * ``("sweep", cycle, *args)`` polls it and puts ``(name, cycle, stats)``
+      on ``outbox``
+    * ``("stop",)`` flushes and exits
+
+    A worker that dies or misses the sweep deadline is taken off the ring
+    and its systems are handed to the others. It is restarted and put back
+    after ``respawn_delay`` seconds.
+
+    Args:
+        target (callable): Module level worker function
+        settings (dict): Picklable worker configuration
+        sites (list): Site tuples to shard by system id
+        workers (int): Number of processes
+        timeout (int): Seconds a sweep may take before a worker is dropped
+        respawn_delay (int): Seconds before a dropped worker is restarted
+    """
+
+    def __init__(
+        self, target, settings, sites, workers=4, timeout=300, respawn_delay=60
+    ):
+        self.target = target
+        self.settings = settings
+        self.sites = list(sites)
+        self.names = [f"shard-{index}" for index in range(workers)]
+        self.timeout = timeout
+        self.respawn_delay = respawn_delay
+        self.context = multiprocessing.get_context("spawn")
+        self.outbox = self.context.Queue()
+        self.processes = {}
+        self.inboxes = {}
+        self.dropped = {}
+        self.ring = HashRing()
+        self.cycle = 0
+        self.last = {}
+
+    def spawn(self, name):
+        """Start one worker process and put it on the ring"""
+        inbox = self.context.Queue()
+        process = self.context.Process(
+            target=self.target,
+            args=(name, self.settings, inbox, self.outbox),
+            name=name,
+            daemon=True,
+        )
+        process.start()
+        self.processes[name] = process
+        self.inboxes[name] = inbox
+        self.ring.add(name)
+
+    def start(self):
+        """Start every worker and hand out the fleet"""
+        for name in self.names:
+            self.spawn(name)
+        self.rebalance()
+
+    def shares(self):
+        """Sites per live worker"""
+        shares = {name: [] for name in self.ring.nodes()}
+        for site in self.sites:
+            owner = self.ring.node_for(site.system)
+            if owner is not None:
+                shares[owner].append(site)
+        return shares
+
+    def rebalance(self):
+        """Send every live worker its current share"""
+        for name, share in self.shares().items():
+            self.inboxes[name].put(("assign", share))
+
+    def drop(self, name, reason):
+        """Take a worker off the ring and stop it"""
+        console.log(f"[red]--- {name} dropped ({reason}), rebalancing ---[/]")
+        process = self.processes.pop(name)
+        if process.is_alive():
+            process.terminate()
+        process.join(timeout=5)
+        self.inboxes.pop(name)
+        self.ring.remove(name)
+        self.dropped[name] = time()
+
+    def respawn(self):
+        """Restart dropped workers whose delay has passed
+
+        Returns:
+            bool: True if any worker was restarted
+        """
+        due = [
+            name
+            for name, dropped_at in self.dropped.items()
+            if time() - dropped_at >= self.respawn_delay
+        ]
+        for name in due:
+            del self.dropped[name]
+            console.log(f"[green]--- Restarting {name} ---[/]")
+            self.spawn(name)
+        return bool(due)
+
+    def sweep(self, *args):
+        """Have every live worker poll its share once
+
+        Returns:
+            dict: Worker name -> stats dict it reported
+        """
+        changed = self.respawn()
+        for name, process in list(self.processes.items()):
+            if not process.is_alive():
+                self.drop(name, f"exit code {process.exitcode}")
+                changed = True
+        if changed:
+            self.rebalance()
+
+        self.cycle += 1
+        for inbox in self.inboxes.values():
+            inbox.put(("sweep", self.cycle) + args)
+
+        results = {}
+        deadline = time() + self.timeout
+        while len(results) < len(self.inboxes) and time() < deadline:
+            try:
+                name, cycle, stats = self.outbox.get(timeout=1)
+            except queue.Empty:
+                pending = [name for name in self.inboxes if name not in results]
+                if not any(self.processes[name].is_alive() for name in pending):
+                    break
+                continue
+            if cycle == self.cycle:
+                results[name] = stats
+
+        missing = [name for name in self.inboxes if name not in results]
+        for name in missing:
+            process = self.processes[name]
+            self.drop(
+                name,
+                "timed out" if process.is_alive() else f"exit code {process.exitcode}",
+            )
+        if missing and self.processes:
+            self.rebalance()
+
+        self.last = results
+        return results
+
+    def log_shards(self):
+        """Print per-shard throughput of the last sweep"""
+        shard_table = Table(title="Shard Statistics", box=box.SIMPLE, style="cyan")
+
+        shard_table.add_column("Shard", style="cyan3")
+        for column in ("Systems", "Failed", "Written", "Seconds", "Systems/s"):
+            shard_table.add_column(column, justify="right", style="cyan3")
+
+        for name, stats in sorted(self.last.items()):
+            shard_table.add_row(
+                name,
+                str(stats["systems"]),
+                str(stats["failed"]),
+                str(stats["written"]),
+                f"{stats['seconds']:.3f}",
+                f"{stats['systems'] / max(stats['seconds'], 1e-9):,.0f}",
+            )
+        for name in sorted(self.dropped):
+            shard_table.add_row(name, "-", "-", "-", "-", "down")
+
+        console.print(shard_table)
+
+    def stop(self):
+        """Ask every worker to flush and exit"""
+        for inbox in self.inboxes.values():
+            inbox.put(("stop",))
+        for process in self.processes.values():
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""This script keeps solar documents on disk while MongoDB is unreachable"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import os
+import threading
+from time import time
+from bson import json_util
+from rich.console import Console
+from utils.metrics import BATCH_DOCS, QUEUE_DEPTH
+
+console = Console()
+
+
+class Spool:
+    """Append-only, segmented on-disk queue of MongoDB documents
+
+    Documents are written as extended JSON lines to numbered segment files.
+    Each append is one write followed by at most one fsync, and fsyncs are
+    spaced at least ``sync_interval`` seconds apart; ``sync`` flushes a
+    deferred one. Segments roll over at ``max_bytes`` so drained data can be
+    dropped a file at a time, and a partially drained segment is compacted
+    down to the documents that are still pending.
+
+    Args:
+        path (str): Spool directory
+        max_bytes (int): Segment size before starting a new one
+        sync_interval (float): Minimum seconds between fsyncs
+        queue (str): Label of the segment count in the queue depth gauge
+    """
+
+    def __init__(
+        self,
+        path,
+        max_bytes=4 * 1024 * 1024,
+        sync_interval=1.0,
+        queue="spool_segments",
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.handle = None
+        self.last_sync = 0
+        self.unsynced = False
+        os.makedirs(path, exist_ok=True)
+        segments = self.segments()
+        self.sequence = int(segments[-1].split(".")[0]) + 1 if segments else 0
+        QUEUE_DEPTH.set_function(lambda: len(self.segments()), queue=queue)
+
+    def segments(self):
+        """Segment file names, oldest first"""
+        return sorted(name for name in os.listdir(self.path) if name.endswith(".jsonl"))
+
+    def pending(self):
+        """True when there is anything on disk to replay"""
+        return bool(self.segments())
+
+    def open_segment(self):
+        """Start a new segment file"""
+        name = os.path.join(self.path, f"{self.sequence:08d}.jsonl")
+        self.sequence += 1
+        # pylint: disable-next=consider-using-with
+        self.handle = open(name, "a", encoding="utf-8")
+
+    def close_segment(self):
+        """Sync and close the segment being written, if any"""
+        if self.handle is not None:
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+            self.handle.close()
+            self.handle = None
+            self.unsynced = False
+
+    def append(self, docs):
+        """Write documents durably to the current segment"""
+        if not docs:
+            return
+        BATCH_DOCS.observe(len(docs), sink="spool")
+        lines = "".join(json_util.dumps(doc) + "\n" for doc in docs)
+        with self.lock:
+            if self.handle is None or self.handle.tell() >= self.max_bytes:
+                self.close_segment()
+                self.open_segment()
+            self.handle.write(lines)
+            self.handle.flush()
+            self.unsynced = True
+            if time() - self.last_sync >= self.sync_interval:
+                self.sync_locked()
+        console.log(f"[bright_yellow]--- Spooled {len(docs)} records to disk ---[/]")
+
+    def sync_locked(self):
+        """fsync the current segment, caller holds the lock"""
+        if self.handle is not None and self.unsynced:
+            os.fsync(self.handle.fileno())
+            self.unsynced = False
+        self.last_sync = time()
+
+    def sync(self):
+        """fsync anything written since the last sync"""
+        with self.lock:
+            self.sync_locked()
+
+    def read(self, name):
+        """Load every document in a segment"""
+        with open(os.path.join(self.path, name), encoding="utf-8") as segment:
+            return [json_util.loads(line) for line in segment if line.strip()]
+
+    def compact(self, name, docs):
+        """Replace a segment with only the documents still pending"""
+        target = os.path.join(self.path, name)
+        if not docs:
+            os.remove(target)
+            return
+        tmp_path = target + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as segment:
+            segment.write("".join(json_util.dumps(doc) + "\n" for doc in docs))
+            segment.flush()
+            os.fsync(segment.fileno())
+        os.replace(tmp_path, target)
+
+    def replay(self, write, batch_size=500):
+        """Send spooled documents back through ``write`` in bulk, oldest first
+
+        Args:
+            write (callable): Takes a list of documents and returns the ones
+                that could not be written because MongoDB is still unreachable
+            batch_size (int): Documents per write
+
+        Returns:
+            int: Number of documents replayed
+        """
+        with self.lock:
+            self.close_segment()
+            names = self.segments()
+        replayed = 0
+        for name in names:
+            docs = self.read(name)
+            for start in range(0, len(docs), batch_size):
+                batch = docs[start : start + batch_size]
+                failed = write(batch)
+                replayed += len(batch) - len(failed)
+                if failed:
+                    self.compact(name, failed + docs[start + batch_size :])
+                    return replayed
+            self.compact(name, [])
+        if replayed:
+            console.log(f"[green]--- Replayed {replayed} spooled records ---[/]")
+        return replayed
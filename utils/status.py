@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""This script keeps one current-status document per solar system"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+from datetime import datetime, timezone
+from pymongo import DESCENDING, ReplaceOne
+from pymongo.errors import PyMongoError
+from rich.console import Console
+from utils.metrics import MONGO_SECONDS
+
+console = Console()
+
+FIELDS = ("System", "EpochLastReport", "LastReport", "Collected", "Status", "Reporting")
+
+
+class StatusBoard:
+    """Latest record per system, keyed by system id
+
+    The collector replaces each system's document on every ingest, so the
+    collection only ever holds one small document per system and readers
+    fetch the current state with a point lookup on ``_id`` however large the
+    raw history grows.
+
+    With a ``fanout`` publisher, each update is also multicast to the LED
+    controllers before it is written, so they need no MongoDB connection.
+
+    Args:
+        db (Database): MongoDB database
+        name (str): Status collection name
+        fanout (StatusPublisher): Optional multicast publisher
+    """
+
+    def __init__(self, db, name, fanout=None):
+        self.collection = db[name]
+        self.fanout = fanout
+
+    def publish(self, docs):
+        """Replace the status of every system in a batch of samples
+
+        Returns:
+            bool: False if the status could not be written
+        """
+        if self.fanout is not None and docs:
+            self.fanout.publish(docs)
+        # BSON dates are UTC; a naive local time would be off by the offset
+        updated = datetime.now(timezone.utc)
+        ops = [
+            ReplaceOne(
+                {"_id": doc["System"]},
+                dict({field: doc[field] for field in FIELDS}, Updated=updated),
+                upsert=True,
+            )
+            for doc in docs
+        ]
+        if not ops:
+            return True
+        try:
+            with MONGO_SECONDS.time(op="status"):
+                self.collection.bulk_write(ops, ordered=False)
+        except PyMongoError as error:
+            console.log(f"[red]--- Status not updated: {error} ---[/]")
+            return False
+        return True
+
+    def latest(self, system=None):
+        """Current status of a system, or the most recent of any system"""
+        if system is not None:
+            return self.collection.find_one({"_id": system})
+        return self.collection.find_one(sort=[("EpochLastReport", DESCENDING)])
+
+    def all(self):
+        """Current status of every system"""
+        return list(self.collection.find())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""This script follows system status updates through a MongoDB change stream"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import os
+import threading
+from bson import json_util
+from pymongo.errors import OperationFailure, PyMongoError
+from rich.console import Console
+
+console = Console()
+
+
+class RecordWatcher:
+    """Hand every status update to a callback as soon as it lands
+
+    Follows the status collection kept by utils.status.StatusBoard, which
+    is a plain collection, rather than the raw solar collection, which is
+    usually time-series and cannot be watched. Each upsert there replaces
+    one system's document; with a ``system``, only that one is followed.
+
+    The change stream resume token is kept in memory and, when ``token_path``
+    is set, on disk, so a restart picks up where the stream left off.
+    Change streams need a replica set and do not work on time-series
+    collections; when the server refuses, the watcher stops and ``active``
+    turns False so the caller can fall back to polling.
+
+    Args:
+        collection (Collection): Status collection
+        callback (callable): Called with each new status document
+        token_path (str): File that keeps the resume token across restarts
+        retry (int): Seconds to wait before reopening a dropped stream
+        system (str): Only follow this system id
+    """
+
+    source = "change stream"
+
+    def __init__(self, collection, callback, token_path=None, retry=30, system=None):
+        self.collection = collection
+        self.system = system
+        self.callback = callback
+        self.token_path = token_path
+        self.retry = retry
+        self.token = self.load_token()
+        self.latest = None
+        self.active = False
+        self.stopped = threading.Event()
+
+    def load_token(self):
+        """Read the saved resume token, if any"""
+        if self.token_path and os.path.exists(self.token_path):
+            try:
+                with open(self.token_path, encoding="utf-8") as token_file:
+                    return json_util.loads(token_file.read())
+            except (OSError, ValueError) as error:
+                console.log(f"[bright_yellow]--- Resume token not loaded: {error}[/]")
+        return None
+
+    def save_token(self):
+        """Write the resume token so a restart can continue the stream"""
+        if not self.token_path:
+            return
+        tmp_path = self.token_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as token_file:
+                token_file.write(json_util.dumps(self.token))
+            os.replace(tmp_path, self.token_path)
+        except OSError as error:
+            console.log(f"[bright_yellow]--- Resume token not saved: {error}[/]")
+
+    def follow(self):
+        """Read the change stream until it fails or stop() is called"""
+        match = {"operationType": {"$in": ["insert", "replace", "update"]}}
+        if self.system is not None:
+            match["fullDocument._id"] = self.system
+        with self.collection.watch(
+            [{"$match": match}],
+            full_document="updateLookup",
+            resume_after=self.token,
+            max_await_time_ms=1000,
+        ) as stream:
+            self.active = True
+            console.log("[green]--- Following status change stream ---[/]")
+            while not self.stopped.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    continue
+                self.token = stream.resume_token
+                self.save_token()
+                self.latest = change["fullDocument"]
+                self.callback(self.latest)
+
+    def run(self):
+        """Keep the change stream open, reconnecting after drops"""
+        while not self.stopped.is_set():
+            try:
+                self.follow()
+            except OperationFailure as error:
+                # History lost, or a token saved from another stream, such as
+                # the raw solar collection followed before
+                if self.token is not None and error.code in (260, 280, 286):
+                    console.log("[bright_yellow]--- Resume token not usable ---[/]")
+                    self.token = None
+                    continue
+                console.log(
+                    f"[bright_yellow]--- Change stream unavailable, polling: "
+                    f"{error} ---[/]"
+                )
+                break
+            except PyMongoError as error:
+                console.log(f"[red]--- Change stream dropped: {error} ---[/]")
+            self.active = False
+            self.stopped.wait(self.retry)
+        self.active = False
+
+    def start(self):
+        """Follow the change stream on a background thread"""
+        threading.Thread(target=self.run, name="watcher", daemon=True).start()
+
+    def stop(self):
+        """Close the change stream"""
+        self.stopped.set()
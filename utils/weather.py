@@ -9,107 +9,334 @@ __license__ = "MIT License"
 from time import time
 from datetime import timedelta
 import configparser
+import json
 import os
-import requests
-from requests.adapters import HTTPAdapter, Retry
-from requests.exceptions import Timeout
+import threading
+from requests.exceptions import RequestException
 from rich import print, box  # pylint: disable=redefined-builtin
 from rich.table import Table
 from rich.console import Console
+from utils.httpclient import get
 
 console = Console()
 
+DAY = 86400
+
+WEATHER_URL = "http://api.openweathermap.org/data/2.5/weather?"
+
+# Cell size in degrees for systems located by lat/lon, about 11 km north-south.
+# Systems in one cell share a single weather request.
+GRID = 0.1
+
+# OpenWeather responses slower than this are flagged on the console; every
+# request is also recorded in the HTTP latency histogram by utils.httpclient.
+SLOW_RESPONSE = timedelta(seconds=0.6)
+
+# Sunrise and sunset move a few minutes a day, so the cached pair is
+# projected forward and only refetched once a day. Cloud cover is only
+# needed in daylight and is refetched after CACHE["ttl"] seconds.
+CACHE = {"ttl": 900, "path": None, "entries": None}
+CACHE_LOCK = threading.Lock()
+
+
+def configure_cache(ttl=None, path=None):
+    """Set the weather cache lifetime and optional on-disk file
+
+    Args:
+        ttl (int): Seconds before cloud cover is refetched in daylight
+        path (str): JSON file that keeps the cache across restarts
+    """
+    with CACHE_LOCK:
+        if ttl is not None:
+            CACHE["ttl"] = ttl
+        if path is not None:
+            CACHE["path"] = path
+            CACHE["entries"] = None
+
+
+def load_cache():
+    """Return the cache entries, reading the on-disk layer on first use"""
+    if CACHE["entries"] is None:
+        CACHE["entries"] = {}
+        if CACHE["path"] and os.path.exists(CACHE["path"]):
+            try:
+                with open(CACHE["path"], encoding="utf-8") as cache_file:
+                    CACHE["entries"] = json.load(cache_file)
+            except (OSError, ValueError) as error:
+                console.log(f"[bright_yellow]Weather cache not loaded: {error}[/]")
+    return CACHE["entries"]
+
+
+def save_cache():
+    """Write the cache entries to the on-disk layer, if one is configured"""
+    if not CACHE["path"]:
+        return
+    tmp_path = CACHE["path"] + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as cache_file:
+            json.dump(CACHE["entries"], cache_file)
+        os.replace(tmp_path, CACHE["path"])
+    except OSError as error:
+        console.log(f"[bright_yellow]Weather cache not saved: {error}[/]")
+
+
+def project_sun(entry, localtime):
+    """Shift a cached sunrise/sunset pair onto the current day"""
+    days = (localtime - entry["sunrise"]) // DAY
+    return (entry["sunrise"] + days * DAY, entry["sunset"] + days * DAY)
+
+
+def cache_key(zip_code, units):
+    """Key a cache entry by location and units"""
+    return zip_code + "|" + units
+
+
+def sun_times(zip_code, units, localtime=None):
+    """Return today's (sunrise, sunset) from the cache without a request
+
+    Returns:
+        tuple: Projected (sunrise, sunset) epochs, or None if nothing is cached
+    """
+    with CACHE_LOCK:
+        entry = load_cache().get(cache_key(zip_code, units))
+    if entry is None:
+        return None
+    return project_sun(entry, time() if localtime is None else localtime)
+
+
+def weather_id(zip_code, units):
+    """Return the cached OpenWeather condition id without a request, or None"""
+    with CACHE_LOCK:
+        entry = load_cache().get(cache_key(zip_code, units))
+    return None if entry is None else entry["weather_id"]
+
+
+def cached_weather(zip_code, units, url):
+    """Return weather details from the cache, fetching only when needed
+
+    Returns:
+        tuple: (entry dict, status code, source) where source is
+        "cache" or "api"
+    """
+    key = cache_key(zip_code, units)
+    localtime = time()
+
+    with CACHE_LOCK:
+        entries = load_cache()
+        entry = entries.get(key)
+
+        if entry is not None and localtime - entry["fetched"] < DAY:
+            sunrise, sunset = project_sun(entry, localtime)
+            daylight = sunset > localtime > sunrise
+            if not daylight or localtime - entry["fetched"] < CACHE["ttl"]:
+                return (entry, 200, "cache")
+
+    # Fetch without the lock so other zips and cells are not held up
+    response, status_code, failed = retrieve_weather(url)
+
+    if failed is False and status_code == 200:
+        data = response.json()
+        entry = {
+            "fetched": localtime,
+            "weather_id": data["weather"][0]["id"],
+            "sunrise": data["sys"]["sunrise"],
+            "sunset": data["sys"]["sunset"],
+        }
+        with CACHE_LOCK:
+            entries = load_cache()
+            entries[key] = entry
+            save_cache()
+        return (entry, status_code, "api")
+
+    if entry is not None:
+        console.log("[bright_yellow]Using stale cached weather.[/]")
+        return (entry, status_code, "cache")
+
+    return (None, status_code, "api")
+
 
 def retrieve_weather(url):
     """Request weather information"""
-    timeout = False
+    failed = False
     try:
-        retries = Retry(
-            total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504]
-        )
-        adapter = HTTPAdapter(max_retries=retries)
-        http = requests.Session()
-        http.mount("http://", adapter)
-        response = http.get(url, timeout=5)
+        response = get(url, "weather", timeout=5)
         status_code = response.status_code
         response_time = response.elapsed
-        if response_time > timedelta(seconds=0.6):
+        if response_time > SLOW_RESPONSE:
             console.log(
                 f"[bright_yellow]Response time to Open Weather API: {response_time}[/]"
             )
         else:
             console.log(f"[green]Response time to Open Weather API: {response_time}[/]")
 
-    except Timeout:
-        print("[red bold]The 'get weather' request timed out![/]")
+    except RequestException as error:
+        print(f"[red bold]The 'get weather' request failed: {error}[/]")
         response = "error"
         status_code = 0
-        timeout = True
-    return (response, status_code, timeout)
+        failed = True
+    return (response, status_code, failed)
 
 
-def weather(api, zip_code, units):
-    """Get weather details"""
-    console.log("[green]Entered weather function.[/]")
+def derive(entry, localtime):
+    """Turn a cache entry into day/night and cloud cover
 
-    url = (
-        "http://api.openweathermap.org/data/2.5/weather?"
-        + "zip="
-        + zip_code
-        + "&appid="
-        + api
-        + "&units="
-        + units
-    )
+    Returns:
+        tuple: (localviz, collect, weather id)
+    """
+    if entry is not None:
+        weather_id = entry["weather_id"]
+        sunrise, sunset = project_sun(entry, localtime)
+    else:
+        weather_id = 804
+        sunrise = time() - (time() - 60)
+        sunset = time() + (time() + 60)
 
-    response, status_code, timeout = retrieve_weather(url)
+    if sunset > localtime > sunrise:
+        localviz = "day"
 
-    if timeout is False:
-        if status_code == 200:
-            data = response.json()
-            weather_id = data["weather"][0]["id"]
-            sunrise = data["sys"]["sunrise"]
-            sunset = data["sys"]["sunset"]
+        if weather_id == 800:
+            collect = "sun"
+        elif 804 > weather_id > 800:
+            collect = "sun"
         else:
-            weather_id = 804
-            sunrise = time() - (time() - 60)
-            sunset = time() + (time() + 60)
+            collect = "no sun"
 
-        localtime = time()
+    else:
+        localviz = "night"
+        collect = "no sun"
 
-        if sunset > localtime > sunrise:
-            localviz = "day"
+    return (localviz, collect, weather_id)
 
-            if weather_id == 800:
-                collect = "sun"
-            elif 804 > weather_id > 800:
-                collect = "sun"
-            else:
-                collect = "no sun"
 
-        else:
-            localviz = "night"
-            collect = "no sun"
+def location_cell(zip_code=None, lat=None, lon=None, grid=GRID):
+    """Name the weather cell a location falls in
 
-        collect_msg = collect + " (" + str(weather_id) + ")"
+    A zip code is its own cell, so the fleet shares cache entries with
+    weather(). Coordinates snap to the centre of a ``grid`` degree square.
 
-        coltable = Table(title="Weather Statistics", box=box.SIMPLE, style="cyan")
+    Returns:
+        str: Cell name, also its cache key
+    """
+    if lat is not None and lon is not None:
+        lat = round(float(lat) / grid) * grid
+        lon = round(float(lon) / grid) * grid
+        return f"geo:{lat:.4f},{lon:.4f}"
+    return zip_code.strip()
 
-        coltable.add_column("Type", style="cyan3")
-        coltable.add_column("Data", justify="right", style="cyan3")
 
-        coltable.add_row("Status Code", str(status_code))
-        coltable.add_row("Local Visibility", str(localviz))
-        coltable.add_row("Collectibility", collect_msg)
+def cell_url(api, cell, units):
+    """OpenWeather current weather URL for a cell"""
+    if cell.startswith("geo:"):
+        lat, lon = cell[4:].split(",")
+        query = "lat=" + lat + "&lon=" + lon
+    else:
+        query = "zip=" + cell
+    return WEATHER_URL + query + "&appid=" + api + "&units=" + units
 
-        if coltable.columns:
-            console.print(coltable)
-        else:
-            print("[i]No data...[/i]")
 
-        console.log("[green]Exiting weather function.[/]")
+def site_cells(config, sites):
+    """Weather cell of every system
+
+    A ``[SYSTEM <id>]`` section may set ``zip`` or ``lat`` and ``lon``;
+    anything else uses the [WEATHER] zip. [WEATHER] grid sets the cell size
+    in degrees for coordinates.
+
+    Returns:
+        dict: System id -> cell name
+    """
+    grid = config.getfloat("WEATHER", "grid", fallback=GRID)
+    cells = {}
+    for site in sites:
+        section = "SYSTEM " + site.system
+        if not config.has_section(section):
+            section = "WEATHER"
+        cells[site.system] = location_cell(
+            config.get(section, "zip", fallback=config["WEATHER"]["zip"]),
+            config.get(section, "lat", fallback=None),
+            config.get(section, "lon", fallback=None),
+            grid,
+        )
+    return cells
+
+
+def fleet_weather(api, cells, units):
+    """Get weather details once per cell and fan them out to its systems
+
+    Args:
+        api (str): OpenWeather API key
+        cells (dict): System id -> cell name, from site_cells()
+        units (str): OpenWeather units
+
+    Returns:
+        dict: System id -> (localviz, collect, weather id)
+    """
+    console.log("[green]Entered fleet weather function.[/]")
+
+    members = {}
+    for system, cell in cells.items():
+        members.setdefault(cell, []).append(system)
+
+    localtime = time()
+    conditions = {}
+    sources = {"api": 0, "cache": 0}
+    for cell, systems in members.items():
+        entry, _, source = cached_weather(cell, units, cell_url(api, cell, units))
+        sources[source] += 1
+        derived = derive(entry, localtime)
+        for system in systems:
+            conditions[system] = derived
+
+    coltable = Table(title="Fleet Weather Statistics", box=box.SIMPLE, style="cyan")
+
+    coltable.add_column("Type", style="cyan3")
+    coltable.add_column("Data", justify="right", style="cyan3")
+
+    coltable.add_row("Systems", str(len(cells)))
+    coltable.add_row("Cells", str(len(members)))
+    coltable.add_row("API requests", str(sources["api"]))
+    coltable.add_row("Cache hits", str(sources["cache"]))
+    coltable.add_row(
+        "Systems in sun",
+        str(sum(derived[:2] == ("day", "sun") for derived in conditions.values())),
+    )
+
+    console.print(coltable)
+
+    console.log("[green]Exiting fleet weather function.[/]")
+
+    return conditions
+
+
+def weather(api, zip_code, units):
+    """Get weather details"""
+    console.log("[green]Entered weather function.[/]")
+
+    url = WEATHER_URL + "zip=" + zip_code + "&appid=" + api + "&units=" + units
+
+    entry, status_code, source = cached_weather(zip_code, units, url)
+
+    localviz, collect, weather_id = derive(entry, time())
+
+    collect_msg = collect + " (" + str(weather_id) + ")"
+
+    coltable = Table(title="Weather Statistics", box=box.SIMPLE, style="cyan")
+
+    coltable.add_column("Type", style="cyan3")
+    coltable.add_column("Data", justify="right", style="cyan3")
+
+    coltable.add_row("Status Code", str(status_code))
+    coltable.add_row("Source", source)
+    coltable.add_row("Local Visibility", str(localviz))
+    coltable.add_row("Collectibility", collect_msg)
+
+    if coltable.columns:
+        console.print(coltable)
+    else:
+        print("[i]No data...[/i]")
+
+    console.log("[green]Exiting weather function.[/]")
 
-        return (localviz, collect)
+    return (localviz, collect)
 
 
 if __name__ == "__main__":
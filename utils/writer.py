@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""This script buffers MongoDB documents and writes them in bulk"""
+
+__author__ = "Aaron Davis"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2022 Aaron Davis"
+__license__ = "MIT License"
+
+import atexit
+import threading
+from collections import deque
+from time import time
+import bson
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, DocumentTooLarge
+from rich.console import Console
+from utils.metrics import BATCH_DOCS, MONGO_SECONDS, QUEUE_DEPTH
+
+console = Console()
+
+DUPLICATE_KEY = 11000
+
+# Write error codes worth replaying: elections, shutdowns, network errors,
+# timeouts and write conflicts. Anything else, such as 121 (document failed
+# validation), fails the same way every time.
+TRANSIENT_CODES = {
+    6,  # HostUnreachable
+    7,  # HostNotFound
+    50,  # MaxTimeMSExpired
+    64,  # WriteConcernFailed
+    89,  # NetworkTimeout
+    91,  # ShutdownInProgress
+    112,  # WriteConflict
+    189,  # PrimarySteppedDown
+    262,  # ExceededTimeLimit
+    9001,  # SocketException
+    10107,  # NotWritablePrimary
+    11600,  # InterruptedAtShutdown
+    11602,  # InterruptedDueToReplStateChange
+    13435,  # NotPrimaryNoSecondaryOk
+    13436,  # NotPrimaryOrSecondary
+}
+
+MAX_BSON_SIZE = 16 * 1024 * 1024
+
+
+class BufferedWriter:
+    """Gather documents from many polls and flush them to MongoDB in bulk
+
+    Documents are flushed with ``insert_many(ordered=False)``, or as upserts
+    when ``upsert_keys`` is set, once ``max_docs`` are waiting or ``max_delay``
+    seconds have passed since the last flush. Documents that fail with a
+    transient error are put back at the front of the buffer and replayed on
+    the next flush. Permanent rejections, such as failed validation or an
+    oversized document, are logged and moved to ``dead_letter``. Duplicate
+    keys are dropped. With a ``spool``, everything buffered during an
+    outage goes to disk instead and the background thread replays it once
+    MongoDB is reachable again.
+
+    Args:
+        collection (Collection): Target MongoDB collection
+        max_docs (int): Flush once this many documents are buffered
+        max_delay (int): Flush once this many seconds have passed
+        max_buffer (int): Refuse new documents beyond this many
+        upsert_keys (tuple): Fields identifying a document for bulk upserts
+        spool (Spool): On-disk queue for documents written during outages
+        dead_letter (Spool): Where rejected documents are kept, dropped if None
+    """
+
+    def __init__(
+        self,
+        collection,
+        max_docs=500,
+        max_delay=60,
+        max_buffer=10000,
+        upsert_keys=None,
+        spool=None,
+        dead_letter=None,
+    ):
+        self.collection = collection
+        self.max_docs = max_docs
+        self.max_delay = max_delay
+        self.max_buffer = max_buffer
+        self.upsert_keys = upsert_keys
+        self.spool = spool
+        self.dead_letter = dead_letter
+        self.buffer = deque()
+        self.last_flush = time()
+        self.lock = threading.Lock()
+        self.flushing = threading.Lock()
+        self.stopped = threading.Event()
+        self.written = 0
+        self.replayed = 0
+        self.refused = 0
+        self.spooled = 0
+        self.rejected = 0
+        QUEUE_DEPTH.set_function(lambda: len(self.buffer), queue="writer")
+
+    @property
+    def pressure(self):
+        """Fraction of the buffer in use, 1.0 means new documents are refused"""
+        return len(self.buffer) / self.max_buffer
+
+    def add(self, doc):
+        """Buffer one document
+
+        Returns:
+            bool: False when the buffer is full and the document was refused
+        """
+        with self.lock:
+            if len(self.buffer) >= self.max_buffer:
+                self.refused += 1
+                console.log(
+                    f"[red]--- Write buffer full ({self.max_buffer}), "
+                    "document refused ---[/]"
+                )
+                return False
+            self.buffer.append(doc)
+            if self.pressure > 0.8:
+                console.log(
+                    f"[bright_yellow]--- Write buffer at {self.pressure:.0%} ---[/]"
+                )
+        return True
+
+    def extend(self, docs):
+        """Buffer many documents, returning how many were accepted"""
+        return sum(self.add(doc) for doc in docs)
+
+    def due(self):
+        """True when a size or time threshold has been reached"""
+        return len(self.buffer) >= self.max_docs or (
+            bool(self.buffer) and time() - self.last_flush >= self.max_delay
+        )
+
+    def maybe_flush(self):
+        """Flush only if a threshold has been reached"""
+        if self.due():
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """Write everything buffered, one batch of ``max_docs`` at a time
+
+        Returns:
+            int: Number of documents written
+        """
+        written = 0
+        with self.flushing:
+            self.last_flush = time()
+            while True:
+                with self.lock:
+                    batch = [
+                        self.buffer.popleft()
+                        for _ in range(min(self.max_docs, len(self.buffer)))
+                    ]
+                if not batch:
+                    break
+                failed, outage, rejected = self._write(batch)
+                written += len(batch) - len(failed) - rejected
+                if failed and outage and self.spool is not None:
+                    with self.lock:
+                        failed.extend(self.buffer)
+                        self.buffer.clear()
+                    self.spool.append(failed)
+                    self.spooled += len(failed)
+                    break
+                if failed:
+                    self.replayed += len(failed)
+                    with self.lock:
+                        self.buffer.extendleft(reversed(failed))
+                    break
+
+        self.written += written
+        if written:
+            console.log(f"[green]--- Flushed {written} MongoDB records ---[/]")
+        return written
+
+    def reject(self, docs, reason):
+        """Move documents MongoDB will never accept out of the buffer"""
+        if not docs:
+            return
+        self.rejected += len(docs)
+        console.log(f"[red]--- {len(docs)} records rejected: {reason} ---[/]")
+        if self.dead_letter is not None:
+            self.dead_letter.append(docs)
+
+    def _write(self, batch):
+        """Send one batch
+
+        Returns:
+            tuple: (documents that need a replay, True if MongoDB is
+            unreachable, number of documents rejected)
+        """
+        BATCH_DOCS.observe(len(batch), sink="mongo")
+        try:
+            if self.upsert_keys:
+                ops = [
+                    ReplaceOne(
+                        {key: doc[key] for key in self.upsert_keys}, doc, upsert=True
+                    )
+                    for doc in batch
+                ]
+                with MONGO_SECONDS.time(op="bulk_write"):
+                    self.collection.bulk_write(ops, ordered=False)
+            else:
+                with MONGO_SECONDS.time(op="insert_many"):
+                    self.collection.insert_many(batch, ordered=False)
+        except BulkWriteError as error:
+            errors = error.details["writeErrors"]
+            failed = [
+                batch[err["index"]] for err in errors if err["code"] in TRANSIENT_CODES
+            ]
+            rejected = [
+                err
+                for err in errors
+                if err["code"] not in TRANSIENT_CODES and err["code"] != DUPLICATE_KEY
+            ]
+            if error.details.get("writeConcernErrors"):
+                console.log("[bright_yellow]--- Write concern not satisfied ---[/]")
+            console.log(
+                f"[red]--- Bulk write partially failed, {len(failed)} of "
+                f"{len(batch)} queued for replay ---[/]"
+            )
+            if rejected:
+                codes = sorted({err["code"] for err in rejected})
+                self.reject(
+                    [batch[err["index"]] for err in rejected],
+                    f"code {codes}, {rejected[0].get('errmsg')}",
+                )
+            return (failed, False, len(rejected))
+        except DocumentTooLarge as error:
+            # Raised for the whole batch before anything is sent
+            sizes = [len(bson.encode(doc)) for doc in batch]
+            oversized = [doc for doc, size in zip(batch, sizes) if size > MAX_BSON_SIZE]
+            self.reject(oversized, error)
+            failed = [doc for doc, size in zip(batch, sizes) if size <= MAX_BSON_SIZE]
+            return (failed, False, len(oversized))
+        except ConnectionFailure as error:
+            console.log(
+                f"[red]--- MongoDB unavailable, {len(batch)} queued: {error}[/]"
+            )
+            return (batch, True, 0)
+        return ([], False, 0)
+
+    def replay_batch(self, batch):
+        """Write a spooled batch, returning it if MongoDB is still unreachable"""
+        failed, outage, _ = self._write(batch)
+        if outage:
+            return failed
+        if failed:
+            self.replayed += len(failed)
+            with self.lock:
+                self.buffer.extendleft(reversed(failed))
+        return []
+
+    def drain(self):
+        """Replay the on-disk spool in bulk"""
+        if self.spool is None or not self.spool.pending():
+            return 0
+        with self.flushing:
+            return self.spool.replay(self.replay_batch, self.max_docs)
+
+    def start(self):
+        """Flush on the time threshold from a background thread"""
+
+        def run():
+            while not self.stopped.wait(self.max_delay):
+                self.maybe_flush()
+                if self.spool is not None:
+                    self.spool.sync()
+                    self.drain()
+
+        threading.Thread(target=run, name="mongo-writer", daemon=True).start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the background thread and flush what is left"""
+        self.stopped.set()
+        self.flush()
+        if self.spool is not None:
+            self.spool.sync()